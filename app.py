@@ -1,6 +1,9 @@
 import customtkinter as ctk
 from tkinter import messagebox
-from vect_db import find_docs, add_doc, delete_doc, update_doc # Ensure this is the updated vect_db
+from vect_db import find_docs, get_store, search, suggest
+from embedding import warm_up_async
+from index_worker import IndexingWorker
+from search_executor import SearchExecutor
 from document import Document
 import uuid
 import threading
@@ -15,6 +18,12 @@ ctk.set_default_color_theme(styles.DEFAULT_COLOR_THEME)
 # Define a similarity threshold for suggestions (0.0 to 1.0)
 # Higher means more similar. 0.35 is a starting point, adjust as needed.
 SIMILARITY_THRESHOLD_SUGGESTIONS = 0.35
+# What to do when the clipboard holds a copy or a slightly edited version of an existing note:
+# "skip" ignores it, "bump" marks the note as updated now, and "merge" also replaces the note's
+# text with the edited version. Anything else saves every capture as a new note.
+CLIPBOARD_DUPLICATE_POLICY = "bump"
+# How often the Tk loop picks up finished background searches, in ms.
+SEARCH_POLL_INTERVAL = 30
 
 
 class NotesApp(ctk.CTk):
@@ -49,22 +58,45 @@ class NotesApp(ctk.CTk):
 
         self.current_doc = None
         self.was_just_deleted_by_emptying = False
+        # Saves are embedded and persisted off the Tk thread.
+        self.index_worker = IndexingWorker(get_store())
+        # The model loads while the window comes up instead of before it.
+        warm_up_async()
+        self.search_executor = SearchExecutor(
+            lambda query, k, threshold, cancelled: search(query, k=k, min_similarity_threshold=threshold, cancelled=cancelled))
 
         self.load_notes()
         self.text_area.bind("<KeyRelease>", self.schedule_save)
         self.save_after_id = None
         self.search_after_id = None
+        self.lexical_hits = []
         self.bind_all("<Button-1>", self.hide_suggestions_on_click_outside, add="+")
-        self.clipboard_monitoring_active = True
+        # A second window on the same notes folder gets a read-only store; it must not capture or save.
+        self.clipboard_monitoring_active = not get_store().read_only
+        if get_store().read_only:
+            messagebox.showwarning("Read-only", "Another RAG Notes window is writing these notes. "
+                                   "This window is read-only and will not save changes.", parent=self)
         self.internal_copy_active = False
         self.clipboard_thread = threading.Thread(target=self._clipboard_monitor_loop, daemon=True)
         self.clipboard_thread.start()
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self._poll_search_results()
+
+    def _poll_search_results(self):
+        self.search_executor.poll()
+        self.search_poll_after_id = self.after(SEARCH_POLL_INTERVAL, self._poll_search_results)
 
     def on_closing(self):
         self.clipboard_monitoring_active = False
         if self.clipboard_thread.is_alive():
             self.clipboard_thread.join(timeout=0.5) 
+        if self.save_after_id:
+            self.after_cancel(self.save_after_id)
+            self.save_after_id = None
+            self.save_note()
+        self.index_worker.close()
+        self.after_cancel(self.search_poll_after_id)
+        self.search_executor.close(timeout=0.5)
         self.destroy()
 
     def copy_note_content(self, event=None):
@@ -97,11 +129,13 @@ class NotesApp(ctk.CTk):
                         last_copied_text_processed_by_monitor = current_clipboard_text 
                         time.sleep(0.1) 
                         continue 
-                    if self.clipboard_monitoring_active: 
+                    if self.clipboard_monitoring_active and self._handle_clipboard_duplicate(current_clipboard_text):
+                        last_copied_text_processed_by_monitor = current_clipboard_text
+                    elif self.clipboard_monitoring_active: 
                         doc_id = str(uuid.uuid4())
-                        new_document = Document(id=doc_id, content=current_clipboard_text)
+                        new_document = Document(id=doc_id, content=current_clipboard_text, source="clipboard")
                         try:
-                            add_doc(new_document)
+                            self.index_worker.submit_update(new_document)
                             print(f"Saved note from clipboard with ID: {doc_id[:8]}")
                             last_copied_text_processed_by_monitor = current_clipboard_text
                         except Exception as e:
@@ -116,6 +150,24 @@ class NotesApp(ctk.CTk):
                 print(f"Error: Unexpected error in clipboard monitor: {repr(e)}")
             time.sleep(1)
 
+    def _handle_clipboard_duplicate(self, text):
+        """Applies CLIPBOARD_DUPLICATE_POLICY; returns True if the text needs no new note."""
+        if CLIPBOARD_DUPLICATE_POLICY not in ("skip", "bump", "merge"):
+            return False
+        duplicate = get_store().find_duplicate(text)
+        if duplicate is None:
+            return False
+        doc, exact = duplicate
+        if CLIPBOARD_DUPLICATE_POLICY == "merge" and not exact:
+            self.index_worker.submit_update(Document(id=doc.id, content=text))
+            print(f"Merged clipboard text into note {doc.id[:8]}.")
+        elif CLIPBOARD_DUPLICATE_POLICY in ("bump", "merge"):
+            get_store().touch_doc(doc.id)
+            print(f"Clipboard text duplicates note {doc.id[:8]}; marked it as updated.")
+        else:
+            print(f"Clipboard text duplicates note {doc.id[:8]}; skipped.")
+        return True
+
     def hide_suggestions_on_click_outside(self, event):
         if event.widget != self.search_entry:
             is_in_suggestions = False
@@ -153,8 +205,8 @@ class NotesApp(ctk.CTk):
 
     def add_note(self, event=None):
         new_id = str(uuid.uuid4())
-        new_doc = Document(id=new_id, content="")
-        add_doc(new_doc) 
+        new_doc = Document(id=new_id, content="", source="typed")
+        self.index_worker.submit_update(new_doc)
         self.current_doc = new_doc
         self.display_note_content(new_doc)
         self.search_var.set("") 
@@ -164,19 +216,25 @@ class NotesApp(ctk.CTk):
 
     def search_notes_action(self, event=None): 
         query = self.search_var.get()
+        # A pending suggestion search would supersede this one and drop its result.
+        if self.search_after_id:
+            self.after_cancel(self.search_after_id)
+            self.search_after_id = None
         self.hide_suggestions()
         if query:
             # For direct search action, always get the top result, no threshold.
-            results = find_docs(query, k=1, min_similarity_threshold=0.0) 
-            if results:
-                self.current_doc = results[0]
-                self.display_note_content(self.current_doc)
-                self.was_just_deleted_by_emptying = False
-            else:
-                messagebox.showinfo("Search", "No notes found matching your query.", parent=self)
+            self.search_executor.submit(query, 1, 0.0, self._open_search_result)
         else:
             self.load_notes()
 
+    def _open_search_result(self, results):
+        if results:
+            self.current_doc = results[0].doc
+            self.display_note_content(self.current_doc)
+            self.was_just_deleted_by_emptying = False
+        else:
+            messagebox.showinfo("Search", "No notes found matching your query.", parent=self)
+
     def schedule_save(self, event=None):
         if self.was_just_deleted_by_emptying:
             self.was_just_deleted_by_emptying = False
@@ -201,20 +259,40 @@ class NotesApp(ctk.CTk):
                 doc_to_delete = self.current_doc
                 self.current_doc = None 
                 self.text_area.delete("1.0", ctk.END)
-                delete_doc(doc_to_delete)
-                print(f"Note {doc_to_delete.id[:8]} deleted due to being empty.")
-                self.was_just_deleted_by_emptying = True
-                self.load_notes(self.search_var.get())
+                # Reload once the delete is applied, so the list cannot show the note again.
+                self._reload_after_delete(self.index_worker.submit_delete(doc_to_delete), doc_to_delete)
             elif new_content != original_content_on_focus:
                 self.current_doc.content = new_content
-                update_doc(self.current_doc)
+                self.index_worker.submit_update(self.current_doc)
                 print(f"Note {self.current_doc.id[:8]} saved.")
         
+    def _reload_after_delete(self, ticket, doc):
+        status = self.index_worker.status(ticket)
+        if status is None:
+            self.after(SEARCH_POLL_INTERVAL, self._reload_after_delete, ticket, doc)
+            return
+        if not status:
+            messagebox.showerror("Delete", f"Note {doc.id[:8]} could not be deleted.", parent=self)
+            return
+        print(f"Note {doc.id[:8]} deleted due to being empty.")
+        if self.current_doc is None:
+            self.was_just_deleted_by_emptying = True
+            self.load_notes(self.search_var.get())
+
     def schedule_search_suggestions(self, event=None):
         if event and event.keysym in ("Return", "Enter", "Up", "Down"): 
             return 
         if self.search_after_id:
             self.after_cancel(self.search_after_id)
+        query = self.search_var.get().strip()
+        if not query:
+            self.hide_suggestions()
+            return
+        # Word-prefix matches show on every keystroke; semantic results follow once typing pauses.
+        # Results of a semantic search for an earlier query must not be merged into these.
+        self.search_executor.cancel()
+        self.lexical_hits = suggest(query, k=5)
+        self._show_suggestions(self.lexical_hits)
         self.search_after_id = self.after(400, self._perform_search_suggestions)
 
     def _clear_suggestions_widgets(self):
@@ -223,22 +301,30 @@ class NotesApp(ctk.CTk):
 
     def _perform_search_suggestions(self):
         query = self.search_var.get().strip()
-        self._clear_suggestions_widgets()
 
         if not query:
             self.hide_suggestions()
             return
 
-        if not self.suggestions_scroll_frame.winfo_ismapped():
-            self.suggestions_scroll_frame.pack(after=self.search_entry.master, fill=ctk.X, padx=10, pady=(2,5),ipady=0)
-            self.suggestions_scroll_frame.lift()
-        
         # Use the SIMILARITY_THRESHOLD_SUGGESTIONS for suggestions
-        suggested_docs = find_docs(query, k=5, min_similarity_threshold=SIMILARITY_THRESHOLD_SUGGESTIONS)
-        
-        if suggested_docs:
-            for doc in suggested_docs:
-                preview = doc.content.replace('\n', ' ').strip()
+        self.search_executor.submit(query, 5, SIMILARITY_THRESHOLD_SUGGESTIONS, self._merge_suggestions)
+
+    def _merge_suggestions(self, semantic_hits):
+        # Semantic matches first, then the word matches they did not already cover.
+        shown = {hit.doc.id for hit in semantic_hits}
+        merged = semantic_hits + [hit for hit in self.lexical_hits if hit.doc.id not in shown]
+        self._show_suggestions(merged[:5])
+
+    def _show_suggestions(self, suggested_hits):
+        self._clear_suggestions_widgets()
+        if suggested_hits:
+            if not self.suggestions_scroll_frame.winfo_ismapped():
+                self.suggestions_scroll_frame.pack(after=self.search_entry.master, fill=ctk.X, padx=10, pady=(2,5),ipady=0)
+                self.suggestions_scroll_frame.lift()
+
+            for hit in suggested_hits:
+                # Preview the passage that matched, not just the start of the note.
+                preview = hit.passage.replace('\n', ' ').strip()
                 if len(preview) > 70: 
                     preview = preview[:67] + "..."
                 else:
@@ -247,7 +333,7 @@ class NotesApp(ctk.CTk):
                 suggestion_button = ctk.CTkButton(
                     self.suggestions_scroll_frame,
                     text=preview,
-                    command=lambda d=doc: self.select_suggestion(d),
+                    command=lambda d=hit.doc: self.select_suggestion(d),
                     **styles.SUGGESTION_BUTTON_STYLE
                 )
                 suggestion_button.pack(fill=ctk.X, pady=(3,0), padx=3)
@@ -258,6 +344,8 @@ class NotesApp(ctk.CTk):
 
 
     def hide_suggestions(self):
+        # Results still on their way would otherwise reopen the dropdown.
+        self.search_executor.cancel()
         if self.suggestions_scroll_frame.winfo_ismapped():
             self.suggestions_scroll_frame.pack_forget()
         self._clear_suggestions_widgets()
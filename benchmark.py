@@ -0,0 +1,321 @@
+"""
+Benchmarks the vector store on synthetic notes.
+
+Embeddings come from the hashing provider, so no model is downloaded and
+the numbers measure the store itself: storage, indexes and ranking.
+
+    python benchmark.py --sizes 1000,10000 --json results.json
+
+Each size runs cold start, bulk insert, single add/update/delete, find_docs,
+a mixed read/write workload and suggestion-style query bursts. With
+`--score-workers 1,2,4,8` it also times exact scans at each thread count, to
+show how sharded scoring scales across cores. The result cache is off, so
+repeated queries are searched again. Per-operation
+latency percentiles, throughput, peak RSS and bytes written are printed, and
+optionally saved as JSON to compare runs between commits.
+"""
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import logging
+
+import embedding
+from document import Document
+
+DEFAULT_SIZES = "1000,10000"
+DEFAULT_DIM = 256
+VOCABULARY_SIZE = 20000
+NOTE_WORDS = (20, 200)
+
+
+def make_vocabulary(rng: np.random.Generator, size: int = VOCABULARY_SIZE) -> List[str]:
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    lengths = rng.integers(3, 10, size=size)
+    return [''.join(rng.choice(letters, length)) for length in lengths]
+
+
+class Corpus:
+    """Synthetic notes with Zipf-distributed words, like real text."""
+
+    def __init__(self, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.vocabulary = make_vocabulary(self.rng)
+        ranks = np.arange(1, len(self.vocabulary) + 1)
+        self.weights = 1.0 / ranks
+        self.weights /= self.weights.sum()
+
+    def text(self, n_words: Optional[int] = None) -> str:
+        if n_words is None:
+            n_words = int(self.rng.integers(*NOTE_WORDS))
+        return " ".join(self.vocabulary[i] for i in self.rng.choice(len(self.vocabulary), n_words, p=self.weights))
+
+    def notes(self, n: int) -> List[Document]:
+        return [Document(str(uuid.uuid4()), self.text()) for _ in range(n)]
+
+    def query(self) -> str:
+        return self.text(int(self.rng.integers(2, 6)))
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    if not samples:
+        return {}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "count": len(samples),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "ops_per_sec": float(len(samples) / max(ms.sum() / 1000.0, 1e-9)),
+    }
+
+
+def timed(fn: Callable, samples: List[float]):
+    started = time.perf_counter()
+    result = fn()
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def process_write_bytes() -> Optional[int]:
+    """Bytes this process has caused to be written to storage, where the OS reports it."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class IOMeter:
+    """Bytes written and on-disk growth across a block of work."""
+
+    def __init__(self, db_dir: str):
+        self.db_dir = db_dir
+
+    def __enter__(self):
+        self.written = process_write_bytes()
+        self.disk = dir_bytes(self.db_dir)
+        self.result = {}
+        return self
+
+    def __exit__(self, *exc):
+        written = process_write_bytes()
+        self.result["disk_bytes"] = dir_bytes(self.db_dir)
+        self.result["disk_growth_bytes"] = self.result["disk_bytes"] - self.disk
+        if written is not None and self.written is not None:
+            self.result["written_bytes"] = written - self.written
+
+
+def bench_size(n: int, args, corpus: Corpus) -> dict:
+    from vect_db import DEFAULT_SHARD_ROWS, VectorStore
+
+    db_dir = tempfile.mkdtemp(prefix=f"rag-notes-bench-{n}-", dir=args.workdir)
+    result = {"notes": n}
+    try:
+        docs = corpus.notes(n)
+        shard_rows = args.shard_rows or DEFAULT_SHARD_ROWS
+        # Without the result cache every repeated query below is scanned again.
+        store = VectorStore(db_dir, shard_rows=shard_rows, result_cache_size=0)
+
+        with IOMeter(db_dir) as io:
+            stats = store.add_docs(docs, batch_size=args.batch_size)
+        result["bulk_insert"] = {"seconds": stats["seconds"], "docs_per_sec": stats["docs_per_sec"],
+                                 "passages": stats["passages"], **io.result}
+
+        if args.ann:
+            started = time.perf_counter()
+            store.build_ann_index()
+            result["build_ann_index_seconds"] = time.perf_counter() - started
+
+        queries = [corpus.query() for _ in range(args.queries)]
+        samples = []
+        for query in queries:
+            timed(lambda: store.find_docs(query, k=5), samples)
+        result["find_docs"] = percentiles(samples)
+        if args.ann:
+            samples = []
+            for query in queries:
+                timed(lambda: store.find_docs(query, k=5, exact=True), samples)
+            result["find_docs_exact"] = percentiles(samples)
+        if args.score_workers:
+            # Query embeddings are cached by now, so this times the scan itself.
+            default_workers = store.score_workers
+            scaling = {}
+            for workers in args.score_workers:
+                store.score_workers = workers
+                samples = []
+                for query in queries:
+                    timed(lambda: store.find_docs(query, k=5, exact=True), samples)
+                scaling[str(workers)] = percentiles(samples)
+            store.score_workers = default_workers
+            result["score_scaling"] = {"shard_rows": shard_rows, "workers": scaling}
+
+        ops = {"add_doc": [], "update_doc": [], "delete_doc": []}
+        added = corpus.notes(args.writes)
+        with IOMeter(db_dir) as io:
+            for doc in added:
+                timed(lambda: store.add_doc(doc), ops["add_doc"])
+            for doc in added:
+                doc.content = doc.content + " " + corpus.text(10)
+                timed(lambda: store.update_doc(doc), ops["update_doc"])
+            for doc in added:
+                timed(lambda: store.delete_doc(doc), ops["delete_doc"])
+        for name, samples in ops.items():
+            result[name] = percentiles(samples)
+        result["single_writes_io"] = io.result
+
+        reads, writes = [], []
+        started = time.perf_counter()
+        for i in range(args.mixed_ops):
+            if corpus.rng.random() < args.write_fraction:
+                doc = docs[int(corpus.rng.integers(len(docs)))]
+                doc.content = corpus.text()
+                timed(lambda: store.update_doc(doc), writes)
+            else:
+                query = corpus.query()
+                timed(lambda: store.find_docs(query, k=5), reads)
+        result["mixed"] = {"seconds": time.perf_counter() - started, "write_fraction": args.write_fraction,
+                           "reads": percentiles(reads), "writes": percentiles(writes)}
+
+        # Typing a query: a prefix lookup per keystroke, one semantic search at the end.
+        keystrokes, finals = [], []
+        for _ in range(args.bursts):
+            query = corpus.query()
+            for end in range(1, len(query) + 1):
+                timed(lambda: store.suggest(query[:end], k=5), keystrokes)
+            timed(lambda: store.search(query, k=5), finals)
+        result["suggestion_bursts"] = {"keystroke": percentiles(keystrokes), "final_search": percentiles(finals)}
+
+        store.close()
+        started = time.perf_counter()
+        store = VectorStore(db_dir, result_cache_size=0)
+        opened = time.perf_counter() - started
+        store.find_docs(corpus.query(), k=5)
+        result["cold_start"] = {"open_seconds": opened, "first_query_seconds": time.perf_counter() - started - opened}
+        store.close()
+        result["peak_rss_bytes"] = peak_rss_bytes()
+    finally:
+        if not args.keep:
+            shutil.rmtree(db_dir, ignore_errors=True)
+    return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: dict) -> None:
+    print(f"\n== {result['notes']} notes ==")
+    bulk = result["bulk_insert"]
+    print(f"bulk insert        {bulk['docs_per_sec']:10.1f} docs/s  {bulk['seconds']:.2f}s  "
+          f"disk {bulk['disk_bytes'] / 1e6:.1f} MB")
+    rows = [("find_docs", result["find_docs"]), ("find_docs exact", result.get("find_docs_exact")),
+            ("add_doc", result["add_doc"]), ("update_doc", result["update_doc"]),
+            ("delete_doc", result["delete_doc"]), ("mixed reads", result["mixed"]["reads"]),
+            ("mixed writes", result["mixed"]["writes"]),
+            ("suggest keystroke", result["suggestion_bursts"]["keystroke"]),
+            ("suggest final", result["suggestion_bursts"]["final_search"])]
+    for name, summary in rows:
+        if summary:
+            print(f"{name:18} p50 {summary['p50_ms']:8.2f} ms  p90 {summary['p90_ms']:8.2f} ms  "
+                  f"p99 {summary['p99_ms']:8.2f} ms  {summary['ops_per_sec']:10.1f} ops/s")
+    scaling = result.get("score_scaling")
+    if scaling:
+        baseline = None
+        for workers, summary in scaling["workers"].items():
+            baseline = baseline or summary["p50_ms"]
+            print(f"exact scan {workers:>3} thr p50 {summary['p50_ms']:8.2f} ms  p90 {summary['p90_ms']:8.2f} ms  "
+                  f"speedup {baseline / max(summary['p50_ms'], 1e-9):5.2f}x")
+    cold = result["cold_start"]
+    print(f"cold start         open {cold['open_seconds']:.2f}s  first query {cold['first_query_seconds']:.3f}s")
+    if result["peak_rss_bytes"] is not None:
+        print(f"peak RSS           {result['peak_rss_bytes'] / 1e6:.1f} MB")
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated corpus sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM, help="embedding dimension of the hashing provider")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--writes", type=int, default=100, help="single add/update/delete operations of each kind")
+    parser.add_argument("--mixed-ops", type=int, default=500)
+    parser.add_argument("--write-fraction", type=float, default=0.1)
+    parser.add_argument("--bursts", type=int, default=20, help="simulated typed queries")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--ann", action="store_true", help="also build the IVF index and compare with exact search")
+    parser.add_argument("--score-workers", type=lambda value: [int(n) for n in value.split(",") if n.strip()],
+                        default=None, help="comma-separated scoring thread counts to compare, e.g. 1,2,4,8")
+    parser.add_argument("--shard-rows", type=int, default=None, help="rows per scoring shard (default: the store's)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="where to create the temporary stores")
+    parser.add_argument("--keep", action="store_true", help="keep the stores after the run")
+    parser.add_argument("--json", dest="json_path", default=None, help="write the results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    embedding.set_provider(embedding.HashingEmbeddingProvider(args.dim))
+    corpus = Corpus(args.seed)
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "args": vars(args),
+        "results": [],
+    }
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        result = bench_size(size, args, corpus)
+        report["results"].append(result)
+        if args.json_path != "-":
+            print_result(result)
+
+    if args.json_path == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json_path:
+        with open(args.json_path, "w", encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+from typing import List, Tuple
+import re
+
+DEFAULT_PASSAGE_WORDS = 200
+DEFAULT_OVERLAP_WORDS = 40
+PASSAGE_SEPARATOR = "#"
+
+_WORD_PATTERN = re.compile(r"\S+")
+
+
+def split_passages(text: str, max_words: int = DEFAULT_PASSAGE_WORDS,
+                   overlap_words: int = DEFAULT_OVERLAP_WORDS) -> List[Tuple[int, int]]:
+    """
+    Splits text into overlapping passages of at most `max_words` words and
+    returns their (start, end) character spans. A passage prefers to end at
+    a blank line, so editing one paragraph leaves the other passages
+    unchanged. Short texts, including empty ones, are a single passage.
+    """
+    words = [(m.start(), m.end()) for m in _WORD_PATTERN.finditer(text)]
+    if len(words) <= max_words:
+        return [(0, len(text))]
+    passages = []
+    start = 0
+    while True:
+        end = min(start + max_words, len(words))
+        if end < len(words):
+            for j in range(end, start + max_words // 2, -1):
+                if text.count("\n", words[j - 1][1], words[j][0]) >= 2:
+                    end = j
+                    break
+        passages.append((words[start][0], words[end - 1][1]))
+        if end == len(words):
+            return passages
+        start = max(end - overlap_words, start + 1)
+
+
+def passage_key(doc_id: str, passage_no: int) -> str:
+    return f"{doc_id}{PASSAGE_SEPARATOR}{passage_no}"
+
+
+def parse_passage_key(key: str) -> Tuple[str, int]:
+    """(doc id, passage number). Keys from before chunking are the bare doc id, i.e. passage 0."""
+    doc_id, separator, passage_no = key.rpartition(PASSAGE_SEPARATOR)
+    if not separator or not passage_no.isdigit():
+        return key, 0
+    return doc_id, int(passage_no)
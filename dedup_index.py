@@ -0,0 +1,128 @@
+from typing import Dict, Optional, Set, Tuple
+import numpy as np
+import hashlib
+import threading
+
+from embedding_cache import normalize_text
+from prefix_index import tokenize
+
+SIMHASH_BITS = 64
+# Eight 8-bit bands: two fingerprints within 7 bits of each other share at least one band.
+LSH_BANDS = 8
+# A one-word edit of a 20+ word text moves its fingerprint about 4-6 bits; unrelated texts differ by 18+.
+DEFAULT_MAX_DISTANCE = 6
+# Texts shorter than this are only matched exactly; a few words give unstable fingerprints.
+MIN_NEAR_TOKENS = 16
+_BIT_SHIFTS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def simhash(tokens) -> int:
+    """64-bit SimHash over word counts: similar texts get fingerprints a few bits apart."""
+    counts: Dict[str, int] = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    hashes = np.fromiter((int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), "little")
+                          for token in counts), dtype=np.uint64, count=len(counts))
+    weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.float64)
+    votes = weights @ (2.0 * bits - 1.0)
+    return int(sum(1 << i for i in np.flatnonzero(votes > 0)))
+
+
+def fingerprints(text: str) -> Tuple[str, Optional[int]]:
+    """The content hash of `text` and its SimHash, or None for texts too short to match nearly."""
+    tokens = tokenize(text)
+    return content_hash(text), simhash(tokens) if len(tokens) >= MIN_NEAR_TOKENS else None
+
+
+def _bands(fingerprint: int):
+    width = SIMHASH_BITS // LSH_BANDS
+    mask = (1 << width) - 1
+    return [(band, (fingerprint >> (band * width)) & mask) for band in range(LSH_BANDS)]
+
+
+class DuplicateIndex:
+    """
+    Finds notes with the same or nearly the same content as a new text.
+
+    Exact duplicates are found by a hash of the whitespace-normalized
+    content, near duplicates by SimHash fingerprints bucketed per 8-bit band
+    (LSH), so a lookup only compares against notes sharing a band. Lives in
+    memory and is rebuilt at startup from the fingerprints the DocStore keeps
+    next to each note.
+    """
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._hashes: Dict[str, Set[str]] = {}
+        self._buckets: Dict[Tuple[int, int], Set[str]] = {}
+        self._docs: Dict[str, Tuple[str, Optional[int]]] = {}
+
+    def _remove(self, doc_id: str):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        digest, fingerprint = entry
+        self._hashes[digest].discard(doc_id)
+        if not self._hashes[digest]:
+            del self._hashes[digest]
+        if fingerprint is not None:
+            for band in _bands(fingerprint):
+                self._buckets[band].discard(doc_id)
+                if not self._buckets[band]:
+                    del self._buckets[band]
+
+    def _put(self, doc_id: str, digest: str, fingerprint: Optional[int]):
+        self._remove(doc_id)
+        self._docs[doc_id] = (digest, fingerprint)
+        self._hashes.setdefault(digest, set()).add(doc_id)
+        if fingerprint is not None:
+            for band in _bands(fingerprint):
+                self._buckets.setdefault(band, set()).add(doc_id)
+
+    def put(self, doc_id: str, digest: str, fingerprint: Optional[int]) -> None:
+        """Indexes a note by fingerprints already computed with `fingerprints()`."""
+        with self._lock:
+            self._put(doc_id, digest, fingerprint)
+
+    def add(self, doc_id: str, text: str) -> None:
+        self.put(doc_id, *fingerprints(text))
+
+    def build(self, rows) -> None:
+        """Loads (doc id, content hash, fingerprint) rows."""
+        with self._lock:
+            for row in rows:
+                self._put(*row)
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._remove(doc_id)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def find(self, text: str) -> Optional[Tuple[str, int]]:
+        """
+        The id of a note duplicating `text` and the Hamming distance of their
+        fingerprints (0 for identical content), or None. Exact matches win,
+        then the closest near duplicate.
+        """
+        digest, fingerprint = fingerprints(text)
+        with self._lock:
+            exact = self._hashes.get(digest)
+            if exact:
+                return min(exact), 0
+            if fingerprint is None:
+                return None
+            best = None
+            for band in _bands(fingerprint):
+                for doc_id in self._buckets.get(band, ()):
+                    distance = bin(fingerprint ^ self._docs[doc_id][1]).count("1")
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (doc_id, distance)
+            return best
@@ -0,0 +1,222 @@
+from collections import OrderedDict
+from dedup_index import fingerprints
+from document import Document
+from metadata_index import normalize_tags
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+DOC_DB_NAME = "docs.sqlite3"
+DEFAULT_CACHE_SIZE = 512
+# SQLite's default limit on host parameters per statement.
+_MAX_QUERY_PARAMS = 900
+_UINT64 = 1 << 64
+
+
+def _tags_json(tags) -> Optional[str]:
+    return None if tags is None else json.dumps(normalize_tags(tags))
+
+
+def _to_sql_int(fingerprint: Optional[int]) -> Optional[int]:
+    # SQLite integers are signed 64-bit.
+    if fingerprint is None or fingerprint < _UINT64 // 2:
+        return fingerprint
+    return fingerprint - _UINT64
+
+
+def _from_sql_int(value: Optional[int]) -> Optional[int]:
+    return None if value is None else value % _UINT64
+
+
+class DocStore:
+    """
+    Note bodies packed into a single SQLite table, with an LRU cache of the
+    most recently read or written notes.
+    """
+
+    def __init__(self, db_dir: str, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.db_file = os.path.join(db_dir, DOC_DB_NAME)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, content TEXT NOT NULL)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(docs)")}
+        if "updated_at" not in columns:
+            self._conn.execute("ALTER TABLE docs ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+        if "created_at" not in columns:
+            self._conn.execute("ALTER TABLE docs ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+            self._conn.execute("ALTER TABLE docs ADD COLUMN source TEXT")
+            self._conn.execute("ALTER TABLE docs ADD COLUMN tags TEXT")
+            # The closest known creation time of older notes is their last update.
+            self._conn.execute("UPDATE docs SET created_at = updated_at")
+        if "content_hash" not in columns:
+            # Duplicate-detection fingerprints; older rows are filled in by `iter_fingerprints()`.
+            self._conn.execute("ALTER TABLE docs ADD COLUMN content_hash TEXT")
+            self._conn.execute("ALTER TABLE docs ADD COLUMN simhash INTEGER")
+        self._conn.commit()
+
+    def _remember(self, doc_id: str, content: str):
+        self._cache[doc_id] = content
+        self._cache.move_to_end(doc_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def put(self, doc: Document) -> None:
+        self.put_many([doc])
+
+    def put_many(self, docs: Iterable[Document],
+                 prints: Optional[List[Tuple[str, Optional[int]]]] = None) -> None:
+        """
+        Inserts or updates notes. `created_at` is kept from the first write;
+        a `source` or `tags` of None keeps the stored value. `prints` are the
+        notes' `dedup_index.fingerprints()`, computed here when not given.
+        """
+        docs = list(docs)
+        if prints is None:
+            prints = [fingerprints(doc.content) for doc in docs]
+        with self._lock:
+            now = time.time()
+            self._conn.executemany(
+                "INSERT INTO docs (id, content, updated_at, created_at, source, tags, content_hash, simhash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET content = excluded.content, updated_at = excluded.updated_at, "
+                "source = COALESCE(excluded.source, docs.source), tags = COALESCE(excluded.tags, docs.tags), "
+                "content_hash = excluded.content_hash, simhash = excluded.simhash",
+                [(doc.id, doc.content, now, now, doc.source, _tags_json(doc.tags), digest, _to_sql_int(fingerprint))
+                 for doc, (digest, fingerprint) in zip(docs, prints)])
+            self._conn.commit()
+            for doc in docs:
+                self._remember(doc.id, doc.content)
+
+    def touch(self, doc_id: str) -> None:
+        """Marks a note as updated now without rewriting its content."""
+        with self._lock:
+            self._conn.execute("UPDATE docs SET updated_at = ? WHERE id = ?", (time.time(), doc_id))
+            self._conn.commit()
+
+    def set_tags(self, doc_id: str, tags: List[str]) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE docs SET tags = ? WHERE id = ?", (_tags_json(tags), doc_id))
+            self._conn.commit()
+
+    def updated_at(self, doc_id: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute("SELECT updated_at FROM docs WHERE id = ?", (doc_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def delete(self, doc_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+            self._conn.commit()
+            self._cache.pop(doc_id, None)
+
+    def get(self, doc_id: str) -> Optional[Document]:
+        return self.get_many([doc_id]).get(doc_id)
+
+    def get_many(self, doc_ids: List[str]) -> Dict[str, Document]:
+        """Fetches several notes with one query per batch; missing ids are left out."""
+        found = {}
+        with self._lock:
+            missing = []
+            for doc_id in doc_ids:
+                if doc_id in self._cache:
+                    self._cache.move_to_end(doc_id)
+                    found[doc_id] = Document(doc_id, self._cache[doc_id])
+                else:
+                    missing.append(doc_id)
+            for start in range(0, len(missing), _MAX_QUERY_PARAMS):
+                batch = missing[start:start + _MAX_QUERY_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT id, content FROM docs WHERE id IN ({placeholders})", batch)
+                for doc_id, content in rows:
+                    self._remember(doc_id, content)
+                    found[doc_id] = Document(doc_id, content)
+        return found
+
+    def iter_all(self) -> Iterator[Document]:
+        """Every stored note, least recently updated first, without filling the cache."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, content FROM docs ORDER BY updated_at").fetchall()
+        for doc_id, content in rows:
+            yield Document(doc_id, content)
+
+    def iter_metadata(self, doc_ids: Optional[List[str]] = None) -> Iterator[tuple]:
+        """(id, created_at, updated_at, source, tags) of the given notes, or of all of them."""
+        query = "SELECT id, created_at, updated_at, source, tags FROM docs"
+        with self._lock:
+            if doc_ids is None:
+                rows = self._conn.execute(query).fetchall()
+            else:
+                rows = []
+                for start in range(0, len(doc_ids), _MAX_QUERY_PARAMS):
+                    batch = doc_ids[start:start + _MAX_QUERY_PARAMS]
+                    placeholders = ",".join("?" * len(batch))
+                    rows.extend(self._conn.execute(f"{query} WHERE id IN ({placeholders})", batch))
+        for doc_id, created_at, updated_at, source, tags in rows:
+            yield doc_id, created_at, updated_at, source, json.loads(tags) if tags else []
+
+    def iter_fingerprints(self) -> Iterator[tuple]:
+        """
+        (id, content hash, SimHash) of every note. Rows written before the
+        fingerprints were stored are computed once and saved.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, content_hash, simhash FROM docs "
+                                      "WHERE content_hash IS NOT NULL").fetchall()
+            missing = self._conn.execute("SELECT id, content FROM docs WHERE content_hash IS NULL").fetchall()
+        for doc_id, digest, fingerprint in rows:
+            yield doc_id, digest, _from_sql_int(fingerprint)
+        if not missing:
+            return
+        filled = [(doc_id,) + fingerprints(content) for doc_id, content in missing]
+        with self._lock:
+            # A note rewritten meanwhile already has its own fingerprints.
+            self._conn.executemany("UPDATE docs SET content_hash = ?, simhash = ? WHERE id = ? AND content = ?",
+                                   [(digest, _to_sql_int(fingerprint), doc_id, content)
+                                    for (doc_id, content), (_, digest, fingerprint) in zip(missing, filled)])
+            self._conn.commit()
+        logging.info(f"Stored duplicate-detection fingerprints for {len(filled)} older notes.")
+        yield from filled
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def migrate_folder(self, doc_folder: str) -> int:
+        """
+        One-time import of the legacy one-file-per-note folder. The folder is
+        renamed to `<folder>.migrated` afterwards so it is not imported again.
+        """
+        if not os.path.isdir(doc_folder):
+            return 0
+        docs = []
+        for file_name in os.listdir(doc_folder):
+            if not file_name.endswith(".txt"):
+                continue
+            try:
+                with open(os.path.join(doc_folder, file_name), "r", encoding='utf-8') as f:
+                    docs.append(Document(file_name[:-len(".txt")], f.read()))
+            except (OSError, UnicodeDecodeError) as e:
+                logging.error(f"Could not migrate note {file_name}: {e}")
+        with self._lock:
+            now = time.time()
+            self._conn.executemany("INSERT OR IGNORE INTO docs (id, content, updated_at, created_at) "
+                                   "VALUES (?, ?, ?, ?)", [(doc.id, doc.content, now, now) for doc in docs])
+            self._conn.commit()
+        try:
+            os.replace(doc_folder, doc_folder + ".migrated")
+        except OSError as e:
+            logging.error(f"Migrated {len(docs)} notes but could not rename {doc_folder}: {e}")
+        logging.info(f"Migrated {len(docs)} notes from {doc_folder} into {self.db_file}.")
+        return len(docs)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,7 +1,13 @@
+from typing import List, Optional
+
+
 class Document:
-    def __init__(self, id: str, content: str):
+    def __init__(self, id: str, content: str, source: Optional[str] = None, tags: Optional[List[str]] = None):
         self.id = id
         self.content = content
+        # Written to the metadata index with the note; None keeps what is stored.
+        self.source = source
+        self.tags = tags
 
     def to_file(self, file_path: str):
         with open(file_path, 'w') as f:
@@ -10,4 +16,4 @@ class Document:
 def doc_from_file(file_path: str) -> Document:
     with open(file_path, 'r') as f:
         content = f.read()
-    return Document(id=file_path, content=content)
\ No newline at end of file
+    return Document(id=file_path, content=content)
@@ -1,10 +1,234 @@
-from FlagEmbedding import BGEM3FlagModel
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import hashlib
+import math
+import os
+import re
+import threading
+import logging
 
-model = BGEM3FlagModel("BAAI/bge-m3", use_fp16=True)
+from metrics import span, timed
 
+# Which backend and model to use, e.g. RAG_NOTES_EMBEDDING_MODEL=BAAI/bge-small-en-v1.5.
+# RAG_NOTES_EMBEDDING_PROVIDER=hashing selects the model-free provider used by tests and benchmarks.
+PROVIDER_ENV = "RAG_NOTES_EMBEDDING_PROVIDER"
+MODEL_ENV = "RAG_NOTES_EMBEDDING_MODEL"
+DEFAULT_MODEL_NAME = "BAAI/bge-m3"
+DEFAULT_HASHING_DIM = 1024
+
+# Output sizes of common FlagEmbedding models, so a store can be opened without loading the model.
+KNOWN_MODEL_DIMS = {
+    "BAAI/bge-m3": 1024,
+    "BAAI/bge-large-en-v1.5": 1024,
+    "BAAI/bge-base-en-v1.5": 768,
+    "BAAI/bge-small-en-v1.5": 384,
+    "BAAI/bge-large-zh-v1.5": 1024,
+    "BAAI/bge-base-zh-v1.5": 768,
+    "BAAI/bge-small-zh-v1.5": 512,
+}
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+LexicalWeights = Dict[str, float]
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into dense vectors. `name` identifies the model for caches
+    and stores. Providers with `supports_sparse` also return lexical
+    (term -> weight) vectors from the same forward pass.
+    """
+
+    name = "base"
+    dim = 0
+    supports_sparse = False
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Returns a (len(texts), dim) float32 array."""
+        raise NotImplementedError
+
+    def encode_hybrid(self, texts: List[str], batch_size: int = 32) -> Tuple[np.ndarray, List[LexicalWeights]]:
+        """Dense vectors plus one lexical weight dict per text."""
+        raise NotImplementedError
+
+    def query_terms(self, text: str) -> List[str]:
+        """The lexical terms of a text, using only the tokenizer and no model call."""
+        raise NotImplementedError
+
+    def warm_up(self) -> None:
+        """Loads whatever the provider needs, so the first real call is fast."""
+
+
+class FlagEmbeddingProvider(EmbeddingProvider):
+    """
+    A FlagEmbedding model, loaded on first use rather than at import time.
+    BGE-M3 models use `BGEM3FlagModel`, every other model `FlagModel`.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, use_fp16: bool = True):
+        self.name = model_name
+        self.use_fp16 = use_fp16
+        self._model = None
+        self._tokenizer = None
+        self._dim = KNOWN_MODEL_DIMS.get(model_name)
+        self._lock = threading.Lock()
+
+    @property
+    def is_m3(self) -> bool:
+        return "bge-m3" in self.name.lower()
+
+    @property
+    def supports_sparse(self) -> bool:
+        # Only BGE-M3 produces lexical weights.
+        return self.is_m3
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    logging.info(f"Loading embedding model {self.name}...")
+                    with span("embedding.load_model", model=self.name):
+                        if self.is_m3:
+                            from FlagEmbedding import BGEM3FlagModel
+                            self._model = BGEM3FlagModel(self.name, use_fp16=self.use_fp16)
+                        else:
+                            from FlagEmbedding import FlagModel
+                            self._model = FlagModel(self.name, use_fp16=self.use_fp16)
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        if self._dim is None:
+            self._dim = self.encode(["dimension probe"]).shape[1]
+        return self._dim
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        output = self.model.encode(list(texts), batch_size=batch_size)
+        if self.is_m3:
+            output = output["dense_vecs"]
+        return np.asarray(output, dtype=np.float32).reshape(len(texts), -1)
+
+    def encode_hybrid(self, texts: List[str], batch_size: int = 32) -> Tuple[np.ndarray, List[LexicalWeights]]:
+        if not self.supports_sparse:
+            raise NotImplementedError(f"{self.name} does not produce lexical weights.")
+        output = self.model.encode(list(texts), batch_size=batch_size, return_dense=True, return_sparse=True)
+        dense = np.asarray(output["dense_vecs"], dtype=np.float32).reshape(len(texts), -1)
+        lexical = [{str(term): float(weight) for term, weight in weights.items()} for weights in output["lexical_weights"]]
+        return dense, lexical
+
+    def query_terms(self, text: str) -> List[str]:
+        # Lexical weights are keyed by token id, so queries go through the same tokenizer.
+        if self._tokenizer is None:
+            if self._model is not None:
+                self._tokenizer = self._model.tokenizer
+            else:
+                from transformers import AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.name)
+        return [str(token_id) for token_id in self._tokenizer(text, add_special_tokens=False)["input_ids"]]
+
+    def warm_up(self) -> None:
+        _ = self.model
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic feature-hashing embeddings: every word is hashed to a
+    signed bucket. No model download and no torch, so tests and benchmarks
+    run anywhere. Texts sharing words get similar vectors.
+    """
+
+    supports_sparse = True
+
+    def __init__(self, dim: int = DEFAULT_HASHING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _bucket(self, token: str):
+        digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if (value >> 63) & 1 else -1.0
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in _TOKEN_PATTERN.findall(text.lower()):
+                bucket, sign = self._bucket(token)
+                vectors[row, bucket] += sign
+        return vectors
+
+    def encode_hybrid(self, texts: List[str], batch_size: int = 32) -> Tuple[np.ndarray, List[LexicalWeights]]:
+        lexical = []
+        for text in texts:
+            counts = {}
+            for term in self.query_terms(text):
+                counts[term] = counts.get(term, 0) + 1
+            lexical.append({term: 1.0 + math.log(count) for term, count in counts.items()})
+        return self.encode(texts, batch_size), lexical
+
+    def query_terms(self, text: str) -> List[str]:
+        return _TOKEN_PATTERN.findall(text.lower())
+
+
+def provider_from_env() -> EmbeddingProvider:
+    provider = os.environ.get(PROVIDER_ENV, "flag").lower()
+    if provider == "hashing":
+        return HashingEmbeddingProvider()
+    if provider != "flag":
+        logging.warning(f"Unknown embedding provider '{provider}', using FlagEmbedding.")
+    return FlagEmbeddingProvider(os.environ.get(MODEL_ENV, DEFAULT_MODEL_NAME))
+
+
+_provider: Optional[EmbeddingProvider] = None
+_provider_lock = threading.Lock()
+
+def get_provider() -> EmbeddingProvider:
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = provider_from_env()
+    return _provider
+
+def set_provider(provider: EmbeddingProvider) -> None:
+    """Replaces the embedding backend; call it before the vector store is opened."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
+def warm_up_async() -> threading.Thread:
+    """Loads the embedding model on a background thread."""
+    def warm_up():
+        try:
+            get_provider().warm_up()
+        except Exception as e:
+            logging.error(f"Embedding model warm-up failed: {e}")
+    thread = threading.Thread(target=warm_up, daemon=True)
+    thread.start()
+    return thread
+
+@timed("embedding.get_embedding")
 def get_embedding(text):
     """
     This function takes a text input and returns its embedding.
     """
-    embedding = model.encode(text)["dense_vecs"]
-    return embedding
\ No newline at end of file
+    embedding = get_provider().encode([text])[0]
+    return embedding
+
+@timed("embedding.get_hybrid_embeddings")
+def get_hybrid_embeddings(texts, batch_size=32):
+    """
+    This function takes a list of texts and returns their dense embeddings
+    together with their lexical (term -> weight) vectors.
+    """
+    return get_provider().encode_hybrid(list(texts), batch_size=batch_size)
+
+@timed("embedding.get_embeddings")
+def get_embeddings(texts, batch_size=32):
+    """
+    This function takes a list of texts and returns their embeddings as one
+    (len(texts), dim) array, running the model on batches of `batch_size`.
+    """
+    embeddings = get_provider().encode(list(texts), batch_size=batch_size)
+    return embeddings
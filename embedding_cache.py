@@ -0,0 +1,201 @@
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+CACHE_DB_NAME = "embeddings.sqlite3"
+DEFAULT_MAX_QUERY_ENTRIES = 1024
+DEFAULT_MAX_DISK_BYTES = 256 * 1024 * 1024
+
+
+def normalize_text(text: str) -> str:
+    # Whitespace-only edits map to the same cache entry.
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model name, content hash).
+
+    Query embeddings are kept in an in-memory LRU of `max_query_entries`;
+    document embeddings go to an on-disk tier capped at `max_disk_bytes`,
+    evicting the least recently used entries first. The disk tier is one
+    SQLite table per model, with the vector as a blob next to the lexical
+    weights of hybrid models.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, max_query_entries: int = DEFAULT_MAX_QUERY_ENTRIES,
+                 max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES):
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self.max_query_entries = max_query_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()
+        self._disk_entries = OrderedDict()
+        self._disk_bytes = 0
+        self.hits = {"query": 0, "document": 0}
+        self.misses = {"query": 0, "document": 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, CACHE_DB_NAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+                           "lexical TEXT, size INTEGER NOT NULL, written_at REAL NOT NULL)")
+        self._conn.commit()
+        self._import_files()
+        for key, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY written_at"):
+            self._disk_entries[key] = size
+            self._disk_bytes += size
+
+    def _import_files(self):
+        # Entries of the one-file-per-passage layout used before the table.
+        rows = []
+        paths = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".npy"):
+                continue
+            key = entry.name[:-len(".npy")]
+            lexical_path = os.path.join(self.cache_dir, key + ".lex.json")
+            paths.extend([entry.path, lexical_path])
+            try:
+                vector = np.load(entry.path).astype(np.float32).tobytes()
+                lexical = None
+                if os.path.exists(lexical_path):
+                    with open(lexical_path, "r", encoding='utf-8') as f:
+                        lexical = f.read()
+            except (OSError, ValueError) as e:
+                logging.warning(f"Dropping unreadable embedding cache file {entry.path}: {e}")
+                continue
+            rows.append((key, vector, lexical, len(vector) + len(lexical or ""), entry.stat().st_mtime))
+        if not paths:
+            return
+        self._conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector, lexical, size, written_at) "
+                               "VALUES (?, ?, ?, ?, ?)", rows)
+        self._conn.commit()
+        for path in paths:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logging.warning(f"Could not remove imported embedding cache file {path}: {e}")
+        logging.info(f"Moved {len(rows)} embedding cache entries into {CACHE_DB_NAME}.")
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+    def get_query(self, text: str) -> Optional[np.ndarray]:
+        key = self.key(text)
+        with self._lock:
+            entry = self._queries.get(key)
+            if entry is None:
+                self.misses["query"] += 1
+                return None
+            self._queries.move_to_end(key)
+            self.hits["query"] += 1
+            return entry[0]
+
+    def get_query_lexical(self, text: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._queries.get(self.key(text))
+            return None if entry is None else entry[1]
+
+    def put_query(self, text: str, embedding, lexical: Optional[dict] = None) -> None:
+        embedding = np.array(embedding, dtype=np.float32).reshape(-1)
+        embedding.setflags(write=False)
+        key = self.key(text)
+        with self._lock:
+            if lexical is None and key in self._queries:
+                lexical = self._queries[key][1]
+            self._queries[key] = (embedding, lexical)
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.max_query_entries:
+                self._queries.popitem(last=False)
+
+    def _row(self, key: str, column: str):
+        row = self._conn.execute(f"SELECT {column} FROM embeddings WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_document(self, text: str) -> Optional[np.ndarray]:
+        key = self.key(text)
+        with self._lock:
+            blob = self._row(key, "vector") if key in self._disk_entries else None
+            if blob is None:
+                self.misses["document"] += 1
+                return None
+            self._disk_entries.move_to_end(key)
+            self.hits["document"] += 1
+            return np.frombuffer(blob, dtype=np.float32)
+
+    def get_lexical(self, text: str) -> Optional[dict]:
+        """Cached lexical weights of a document text; does not count towards hits/misses."""
+        key = self.key(text)
+        with self._lock:
+            lexical = self._row(key, "lexical") if key in self._disk_entries else None
+        if lexical is None:
+            return None
+        try:
+            return json.loads(lexical)
+        except ValueError as e:
+            logging.warning(f"Ignoring unreadable lexical cache entry {key}: {e}")
+            return None
+
+    def put_document(self, text: str, embedding, lexical: Optional[dict] = None) -> None:
+        self.put_documents([text], [embedding], [lexical])
+
+    def put_documents(self, texts: List[str], embeddings, lexical: Optional[List[Optional[dict]]] = None) -> None:
+        """Caches several document embeddings in one transaction."""
+        lexical = lexical if lexical is not None else [None] * len(texts)
+        rows = []
+        now = time.time()
+        for text, embedding, weights in zip(texts, embeddings, lexical):
+            vector = np.asarray(embedding, dtype=np.float32).reshape(-1).tobytes()
+            weights_json = None if weights is None else json.dumps(weights)
+            rows.append((self.key(text), vector, weights_json, len(vector) + len(weights_json or ""), now))
+        with self._lock:
+            try:
+                # An entry cached without lexical weights gains them; a complete one is left alone.
+                self._conn.executemany(
+                    "INSERT INTO embeddings (key, vector, lexical, size, written_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET lexical = COALESCE(embeddings.lexical, excluded.lexical), "
+                    "size = MAX(embeddings.size, excluded.size), written_at = excluded.written_at", rows)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Could not write {len(rows)} embedding cache entries: {e}")
+                return
+            for key, _, _, size, _ in rows:
+                old_size = self._disk_entries.get(key, 0)
+                self._disk_entries[key] = max(size, old_size)
+                self._disk_entries.move_to_end(key)
+                self._disk_bytes += self._disk_entries[key] - old_size
+            evicted = []
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk_entries) > 1:
+                old_key, old_size = self._disk_entries.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append((old_key,))
+            if evicted:
+                self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "query_hits": self.hits["query"],
+                "query_misses": self.misses["query"],
+                "query_entries": len(self._queries),
+                "document_hits": self.hits["document"],
+                "document_misses": self.misses["document"],
+                "document_entries": len(self._disk_entries),
+                "document_bytes": self._disk_bytes,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from document import Document
+from typing import Optional
+import threading
+import time
+import logging
+
+DEFAULT_MAX_BATCH = 32
+DEFAULT_BATCH_DELAY = 0.05
+
+_PUT = "put"
+_DELETE = "delete"
+
+
+class IndexingWorker:
+    """
+    Applies writes to a `VectorStore` on a background thread.
+
+    Submitting a write only records it in a queue keyed by doc id, so repeated
+    saves of the same note collapse into the latest one and only that content
+    is embedded. Pending writes are applied in batches; `flush()` waits until
+    everything submitted so far is applied and synced to disk, and reports
+    writes that raised.
+    """
+
+    def __init__(self, store, max_batch: int = DEFAULT_MAX_BATCH, batch_delay: float = DEFAULT_BATCH_DELAY):
+        self.store = store
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self._pending = OrderedDict()
+        self._submitted = 0
+        self._applied = 0
+        self._failed = set()
+        self._flushed = 0
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _submit(self, op: str, doc: Document) -> int:
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("IndexingWorker is closed.")
+            self._submitted += 1
+            # A coalesced write also stands in for the earlier tickets it replaced.
+            tickets = self._pending[doc.id][2] + [self._submitted] if doc.id in self._pending else [self._submitted]
+            # Snapshot the content: the caller may keep editing the same Document object.
+            snapshot = Document(doc.id, doc.content, doc.source, doc.tags)
+            if doc.id in self._pending and op == _PUT:
+                # Metadata left unset by a later edit still comes from the write it replaces.
+                replaced = self._pending[doc.id][1]
+                snapshot.source = replaced.source if snapshot.source is None else snapshot.source
+                snapshot.tags = replaced.tags if snapshot.tags is None else snapshot.tags
+            self._pending[doc.id] = (op, snapshot, tickets)
+            self._pending.move_to_end(doc.id)
+            self._condition.notify_all()
+            return self._submitted
+
+    def submit_update(self, doc: Document) -> int:
+        """Queues an add/update of `doc`; returns a ticket that `flush()` can wait for."""
+        return self._submit(_PUT, doc)
+
+    def submit_delete(self, doc: Document) -> int:
+        return self._submit(_DELETE, doc)
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def _take_batch(self):
+        with self._condition:
+            while self._running and not self._pending:
+                self._condition.wait()
+            if not self._pending:
+                return None
+        # Give a burst of saves a moment to coalesce before embedding.
+        time.sleep(self.batch_delay)
+        with self._condition:
+            batch = []
+            while self._pending and len(batch) < self.max_batch:
+                batch.append(self._pending.popitem(last=False)[1])
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            failed = []
+            for op, doc, tickets in batch:
+                if op == _DELETE:
+                    try:
+                        self.store.delete_doc(doc)
+                    except Exception as e:
+                        logging.error(f"Background delete of {doc.id} failed: {e}")
+                        failed.extend(tickets)
+            puts = [(doc, tickets) for op, doc, tickets in batch if op == _PUT]
+            if puts:
+                try:
+                    self.store.add_docs([doc for doc, _ in puts], seal_segment=False)
+                except Exception as e:
+                    logging.error(f"Background indexing failed for {len(puts)} document(s): {e}")
+                    failed.extend(ticket for _, tickets in puts for ticket in tickets)
+            with self._condition:
+                self._failed.update(failed)
+                # Everything up to the newest applied ticket is done, except tickets
+                # still covered by a pending write.
+                newest = max(tickets[-1] for _, _, tickets in batch)
+                oldest_pending = min((tickets[0] for _, _, tickets in self._pending.values()), default=None)
+                self._applied = max(self._applied, newest if oldest_pending is None else min(newest, oldest_pending - 1))
+                self._condition.notify_all()
+
+    def status(self, ticket: int) -> Optional[bool]:
+        """None while the write with `ticket` is pending, then True if it was applied or False if it raised."""
+        with self._condition:
+            if self._applied < ticket:
+                return None
+            return ticket not in self._failed
+
+    def flush(self, ticket: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the write with `ticket` (default: every write submitted so
+        far) is applied and synced to disk. Returns False on timeout, or when
+        that write (default: any write since the last such flush) raised.
+        """
+        with self._condition:
+            target = self._submitted if ticket is None else ticket
+            self._condition.wait_for(lambda: self._applied >= target or not self._thread.is_alive(), timeout)
+            if self._applied < target:
+                return False
+            if ticket is not None:
+                failed = ticket in self._failed
+            else:
+                failed = any(self._flushed < failed_ticket <= target for failed_ticket in self._failed)
+                self._flushed = max(self._flushed, target)
+        self.store.sync()
+        return not failed
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Flushes pending writes and stops the worker thread."""
+        done = self.flush(timeout=timeout)
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        return done
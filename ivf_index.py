@@ -0,0 +1,186 @@
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import os
+import threading
+import logging
+
+CENTROIDS_NAME = "ivf_centroids.npy"
+ASSIGNMENTS_NAME = "ivf_assignments.log"
+DEFAULT_NPROBE = 8
+DEFAULT_TRAIN_ITERATIONS = 10
+ASSIGN_CHUNK_ROWS = 8192
+
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = DEFAULT_TRAIN_ITERATIONS,
+                     seed: int = 0) -> np.ndarray:
+    """k-means on unit vectors using cosine similarity; returns (nlist, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    nlist = max(1, min(nlist, vectors.shape[0]))
+    centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(labels, kind='stable')
+        sorted_labels = labels[order]
+        present, starts = np.unique(sorted_labels, return_index=True)
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+        centroids[present] = sums
+        empty = np.setdiff1d(np.arange(nlist), present)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(vectors.shape[0], len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        np.divide(centroids, norms, out=centroids, where=norms > 1e-9)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest neighbour index.
+
+    Vectors are bucketed under their closest k-means centroid; a query only
+    scores the docs in its `nprobe` closest buckets. The index stores doc ids,
+    not vectors, so it stays valid across segment compactions. Centroids are
+    saved next to the segments and bucket assignments are appended to a log,
+    so inserts and deletes cost as much as the doc being written.
+    """
+
+    def __init__(self, db_dir: str, nprobe: int = DEFAULT_NPROBE, read_only: bool = False):
+        self.centroids_file = os.path.join(db_dir, CENTROIDS_NAME)
+        self.assignments_file = os.path.join(db_dir, ASSIGNMENTS_NAME)
+        self.nprobe = nprobe
+        self.read_only = read_only
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments: Dict[str, int] = {}
+        self.lists: List[set] = []
+        self._log_entries = 0
+        self._lock = threading.Lock()
+        self._log = None
+        if os.path.exists(self.centroids_file):
+            self._load()
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def _load(self):
+        try:
+            self.centroids = np.load(self.centroids_file).astype(np.float32)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load ANN centroids from {self.centroids_file}: {e}. Falling back to exact search.")
+            self.centroids = None
+            return
+        self.lists = [set() for _ in range(self.centroids.shape[0])]
+        if os.path.exists(self.assignments_file):
+            with open(self.assignments_file, "r", encoding='utf-8') as f:
+                for line in f:
+                    list_no, _, doc_id = line.rstrip("\n").partition("\t")
+                    if not doc_id:
+                        continue
+                    self._log_entries += 1
+                    if list_no == "-":
+                        self._unassign(doc_id)
+                    elif list_no.isdigit() and int(list_no) < len(self.lists):
+                        self._assign(doc_id, int(list_no))
+        if not self.read_only:
+            self._log = open(self.assignments_file, "a", encoding='utf-8')
+
+    def _assign(self, doc_id: str, list_no: int):
+        self._unassign(doc_id)
+        self.assignments[doc_id] = list_no
+        self.lists[list_no].add(doc_id)
+
+    def _unassign(self, doc_id: str):
+        list_no = self.assignments.pop(doc_id, None)
+        if list_no is not None:
+            self.lists[list_no].discard(doc_id)
+
+    def _rewrite_log(self):
+        if self._log is not None:
+            self._log.close()
+        tmp_path = self.assignments_file + ".tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            f.writelines(f"{list_no}\t{doc_id}\n" for doc_id, list_no in self.assignments.items())
+        os.replace(tmp_path, self.assignments_file)
+        self._log_entries = len(self.assignments)
+        self._log = open(self.assignments_file, "a", encoding='utf-8')
+
+    def _append_log(self, lines: List[str]):
+        self._log.writelines(lines)
+        self._log.flush()
+        self._log_entries += len(lines)
+        if self._log_entries > 2 * len(self.assignments) + 1024:
+            self._rewrite_log()
+
+    def nearest_lists(self, vectors: np.ndarray, n: int = 1) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        n = min(n, self.centroids.shape[0])
+        result = np.empty((vectors.shape[0], n), dtype=np.int64)
+        for start in range(0, vectors.shape[0], ASSIGN_CHUNK_ROWS):
+            sims = vectors[start:start + ASSIGN_CHUNK_ROWS] @ self.centroids.T
+            if n == 1:
+                result[start:start + sims.shape[0], 0] = np.argmax(sims, axis=1)
+            else:
+                top = np.argpartition(-sims, n - 1, axis=1)[:, :n]
+                order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+                result[start:start + sims.shape[0]] = np.take_along_axis(top, order, axis=1)
+        return result
+
+    def train(self, sample: np.ndarray, nlist: int, iterations: int = DEFAULT_TRAIN_ITERATIONS) -> None:
+        """Learns new centroids from a sample of unit vectors and drops all assignments."""
+        with self._lock:
+            self.centroids = spherical_kmeans(np.asarray(sample, dtype=np.float32), nlist, iterations)
+            tmp_path = self.centroids_file + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, self.centroids)
+            os.replace(tmp_path, self.centroids_file)
+            self.assignments = {}
+            self.lists = [set() for _ in range(self.centroids.shape[0])]
+            self._rewrite_log()
+
+    def add(self, doc_ids: List[str], vectors: np.ndarray) -> None:
+        if not self.trained or not doc_ids:
+            return
+        list_nos = self.nearest_lists(vectors)[:, 0]
+        with self._lock:
+            lines = []
+            for doc_id, list_no in zip(doc_ids, list_nos):
+                self._assign(doc_id, int(list_no))
+                lines.append(f"{int(list_no)}\t{doc_id}\n")
+            self._append_log(lines)
+
+    def remove(self, doc_id: str) -> None:
+        if not self.trained:
+            return
+        with self._lock:
+            if doc_id in self.assignments:
+                self._unassign(doc_id)
+                self._append_log([f"-\t{doc_id}\n"])
+
+    def missing(self, doc_ids: Iterable[str]) -> List[str]:
+        return [doc_id for doc_id in doc_ids if doc_id not in self.assignments]
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> List[str]:
+        """Doc ids in the `nprobe` buckets closest to the query."""
+        list_nos = self.nearest_lists(query, nprobe or self.nprobe)[0]
+        with self._lock:
+            doc_ids = []
+            for list_no in list_nos:
+                doc_ids.extend(self.lists[list_no])
+            return doc_ids
+
+    def drop(self) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            for path in (self.centroids_file, self.assignments_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.centroids = None
+            self.assignments = {}
+            self.lists = []
+
+    def close(self) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
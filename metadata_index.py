@@ -0,0 +1,190 @@
+from typing import Dict, Iterable, List, Optional, Set
+import numpy as np
+import bisect
+import threading
+
+# Where a note came from; stored as given, these are the values the app writes.
+SOURCES = ("typed", "clipboard", "import")
+RECENCY_FIELDS = ("updated", "created")
+FILTER_KEYS = ("source", "tags", "created_after", "created_before", "updated_after", "updated_before")
+_NO_SOURCE = -1
+
+
+def normalize_tags(tags: Optional[Iterable[str]]) -> Optional[List[str]]:
+    if tags is None:
+        return None
+    if isinstance(tags, str):
+        tags = [tags]
+    return sorted({tag.strip() for tag in tags if tag and tag.strip()})
+
+
+class MetadataIndex:
+    """
+    Timestamps, source and tags of every note, kept in memory as columns.
+
+    Each note owns a slot in parallel numpy arrays (created/updated time,
+    source code), so a filter is a few vectorized comparisons over all notes.
+    Tags map to sets of slots. Two lists sorted by (timestamp, doc id) answer
+    "most recent N" without a scan. Rebuilt from the DocStore at startup.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._lock = threading.Lock()
+        self._slots: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._created = np.zeros(capacity, dtype=np.float64)
+        self._updated = np.zeros(capacity, dtype=np.float64)
+        self._source = np.full(capacity, _NO_SOURCE, dtype=np.int16)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._source_codes: Dict[str, int] = {}
+        self._source_names: List[str] = []
+        self._tags: Dict[str, Set[int]] = {}
+        self._slot_tags: Dict[int, List[str]] = {}
+        self._sorted = {"updated": [], "created": []}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _grow(self):
+        size = max(len(self._alive) * 2, 1024)
+        extra = size - len(self._alive)
+        self._created = np.concatenate([self._created, np.zeros(extra, dtype=np.float64)])
+        self._updated = np.concatenate([self._updated, np.zeros(extra, dtype=np.float64)])
+        self._source = np.concatenate([self._source, np.full(extra, _NO_SOURCE, dtype=np.int16)])
+        self._alive = np.concatenate([self._alive, np.zeros(extra, dtype=bool)])
+
+    def _source_code(self, source: Optional[str]) -> int:
+        if source is None:
+            return _NO_SOURCE
+        if source not in self._source_codes:
+            self._source_codes[source] = len(self._source_names)
+            self._source_names.append(source)
+        return self._source_codes[source]
+
+    def _unsort(self, slot: int, doc_id: str):
+        for field, column in (("updated", self._updated), ("created", self._created)):
+            entries = self._sorted[field]
+            i = bisect.bisect_left(entries, (column[slot], doc_id))
+            if i < len(entries) and entries[i] == (column[slot], doc_id):
+                del entries[i]
+
+    def _remove(self, doc_id: str):
+        slot = self._slots.pop(doc_id, None)
+        if slot is None:
+            return
+        self._unsort(slot, doc_id)
+        for tag in self._slot_tags.pop(slot, ()):
+            self._tags[tag].discard(slot)
+            if not self._tags[tag]:
+                del self._tags[tag]
+        self._alive[slot] = False
+        self._ids[slot] = None
+        self._free.append(slot)
+
+    def _put(self, doc_id: str, created_at: float, updated_at: float, source: Optional[str],
+             tags: Optional[Iterable[str]]):
+        tags = normalize_tags(tags) or []
+        self._remove(doc_id)
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._ids)
+            if slot >= len(self._alive):
+                self._grow()
+            self._ids.append(None)
+        self._slots[doc_id] = slot
+        self._ids[slot] = doc_id
+        self._created[slot] = created_at
+        self._updated[slot] = updated_at
+        self._source[slot] = self._source_code(source)
+        self._alive[slot] = True
+        if tags:
+            self._slot_tags[slot] = tags
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(slot)
+
+    def put(self, doc_id: str, created_at: float, updated_at: float, source: Optional[str] = None,
+            tags: Optional[Iterable[str]] = None) -> None:
+        with self._lock:
+            self._put(doc_id, created_at, updated_at, source, tags)
+            bisect.insort(self._sorted["updated"], (float(updated_at), doc_id))
+            bisect.insort(self._sorted["created"], (float(created_at), doc_id))
+
+    def build(self, rows) -> None:
+        """Loads (doc id, created_at, updated_at, source, tags) rows, sorting the recency lists once."""
+        with self._lock:
+            for row in rows:
+                self._put(*row)
+            for field, column in (("updated", self._updated), ("created", self._created)):
+                self._sorted[field] = sorted((float(column[slot]), doc_id) for doc_id, slot in self._slots.items())
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._remove(doc_id)
+
+    def get(self, doc_id: str) -> Optional[dict]:
+        with self._lock:
+            slot = self._slots.get(doc_id)
+            if slot is None:
+                return None
+            code = int(self._source[slot])
+            return {"created_at": float(self._created[slot]), "updated_at": float(self._updated[slot]),
+                    "source": None if code == _NO_SOURCE else self._source_names[code],
+                    "tags": list(self._slot_tags.get(slot, []))}
+
+    def timestamps(self, doc_ids: List[str], by: str = "updated") -> List[float]:
+        """When each of `doc_ids` was last updated (or created), 0 for unknown notes."""
+        if by not in RECENCY_FIELDS:
+            raise ValueError(f"Unknown recency field '{by}', expected one of {RECENCY_FIELDS}.")
+        column = self._updated if by == "updated" else self._created
+        with self._lock:
+            return [float(column[self._slots[doc_id]]) if doc_id in self._slots else 0.0 for doc_id in doc_ids]
+
+    def tags(self) -> Dict[str, int]:
+        """Every tag in use and how many notes carry it."""
+        with self._lock:
+            return {tag: len(slots) for tag, slots in sorted(self._tags.items())}
+
+    def match(self, filters: Optional[dict]) -> Optional[Set[str]]:
+        """
+        Ids of the notes passing `filters`, or None when there is nothing to
+        filter. `source` is one source or a list of them, `tags` a list the
+        note must all carry, and `created_after`/`created_before`/
+        `updated_after`/`updated_before` bound the timestamps (inclusive).
+        """
+        if not filters:
+            return None
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown filters {sorted(unknown)}, expected some of {FILTER_KEYS}.")
+        with self._lock:
+            n = len(self._ids)
+            mask = self._alive[:n].copy()
+            for key, column in (("created", self._created), ("updated", self._updated)):
+                if filters.get(f"{key}_after") is not None:
+                    mask &= column[:n] >= filters[f"{key}_after"]
+                if filters.get(f"{key}_before") is not None:
+                    mask &= column[:n] <= filters[f"{key}_before"]
+            if filters.get("source") is not None:
+                sources = [filters["source"]] if isinstance(filters["source"], str) else filters["source"]
+                codes = [self._source_codes[source] for source in sources if source in self._source_codes]
+                mask &= np.isin(self._source[:n], codes)
+            for tag in normalize_tags(filters.get("tags")) or []:
+                tagged = np.zeros(n, dtype=bool)
+                tagged[list(self._tags.get(tag, ()))] = True
+                mask &= tagged
+            return {self._ids[slot] for slot in np.flatnonzero(mask)}
+
+    def recent(self, n: int, by: str = "updated", allowed: Optional[Set[str]] = None) -> List[str]:
+        """Ids of the `n` most recently updated (or created) notes, newest first, limited to `allowed`."""
+        if by not in RECENCY_FIELDS:
+            raise ValueError(f"Unknown recency field '{by}', expected one of {RECENCY_FIELDS}.")
+        result = []
+        with self._lock:
+            for _, doc_id in reversed(self._sorted[by]):
+                if len(result) >= n:
+                    break
+                if allowed is None or doc_id in allowed:
+                    result.append(doc_id)
+        return result
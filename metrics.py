@@ -0,0 +1,182 @@
+from collections import deque
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import functools
+import json
+import os
+import threading
+import time
+import logging
+
+# RAG_NOTES_METRICS=1 records timings; RAG_NOTES_METRICS=log also logs one JSON line per span.
+METRICS_ENV = "RAG_NOTES_METRICS"
+# Recent durations kept per span for percentiles.
+DEFAULT_WINDOW = 1024
+
+# Called as hook(span name, seconds, fields) after every span, e.g. to feed a profiler or metrics sink.
+SpanHook = Callable[[str, float, dict], None]
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, registry: "Metrics", name: str, fields: dict):
+        self.registry = registry
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        self.registry.record(self.name, time.perf_counter() - self.started, self.fields)
+        return False
+
+    def set(self, **fields):
+        """Attaches fields, e.g. batch sizes, to the span's log line and hooks."""
+        self.fields.update(fields)
+
+
+class Metrics:
+    """
+    Counters and timing histograms for the hot paths.
+
+    Disabled by default: `span()` then hands out a shared no-op context and
+    `incr()` returns at once, so instrumented code pays one attribute check.
+    When enabled, each span keeps its count, total and max time plus a window
+    of recent durations for percentiles, and is passed to the registered hooks.
+    """
+
+    def __init__(self, enabled: bool = False, log: bool = False, window: int = DEFAULT_WINDOW):
+        self.enabled = enabled
+        self.log = log
+        self.window = window
+        self._lock = threading.Lock()
+        self._hooks: List[SpanHook] = []
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters: Dict[str, int] = {}
+            self._timings: Dict[str, dict] = {}
+
+    def span(self, name: str, **fields):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, fields)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def record(self, name: str, seconds: float, fields: Optional[dict] = None) -> None:
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {"count": 0, "total": 0.0, "max": 0.0, "recent": deque(maxlen=self.window)}
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+            timing["recent"].append(seconds)
+            hooks = list(self._hooks)
+        fields = fields or {}
+        if self.log:
+            logging.info(json.dumps({"span": name, "ms": round(seconds * 1000.0, 3), **fields}))
+        for hook in hooks:
+            try:
+                hook(name, seconds, fields)
+            except Exception as e:
+                logging.error(f"Metrics hook {hook!r} failed: {e}")
+
+    def add_hook(self, hook: SpanHook) -> None:
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook: SpanHook) -> None:
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    def stats(self) -> dict:
+        """Counters, plus per span: count, mean/max and p50/p90/p99 of recent durations, in ms."""
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                recent = np.asarray(timing["recent"]) * 1000.0
+                p50, p90, p99 = np.percentile(recent, [50, 90, 99]) if len(recent) else (0.0, 0.0, 0.0)
+                timings[name] = {
+                    "count": timing["count"],
+                    "total_ms": timing["total"] * 1000.0,
+                    "mean_ms": timing["total"] * 1000.0 / timing["count"],
+                    "max_ms": timing["max"] * 1000.0,
+                    "p50_ms": float(p50),
+                    "p90_ms": float(p90),
+                    "p99_ms": float(p99),
+                }
+            return {"enabled": self.enabled, "counters": dict(self._counters), "timings": timings}
+
+
+def _from_env() -> Metrics:
+    setting = os.environ.get(METRICS_ENV, "").lower()
+    return Metrics(enabled=setting not in ("", "0", "false", "off"), log=setting == "log")
+
+
+metrics = _from_env()
+
+def span(name: str, **fields):
+    """Times a block: `with span("search.rank"): ...`."""
+    return metrics.span(name, **fields)
+
+def timed(name: str):
+    """Decorator form of `span()`; a disabled registry costs one check per call."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return fn(*args, **kwargs)
+            with metrics.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def incr(name: str, n: int = 1) -> None:
+    metrics.incr(name, n)
+
+def enable(log: bool = False) -> None:
+    metrics.enabled = True
+    metrics.log = log
+
+def disable() -> None:
+    metrics.enabled = False
+    metrics.log = False
+
+def add_hook(hook: SpanHook) -> None:
+    """Registers a hook and turns recording on."""
+    metrics.add_hook(hook)
+    metrics.enabled = True
+
+def remove_hook(hook: SpanHook) -> None:
+    metrics.remove_hook(hook)
+
+def stats() -> dict:
+    return metrics.stats()
+
+def reset() -> None:
+    metrics.reset()
@@ -0,0 +1,150 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import bisect
+import heapq
+import re
+import threading
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Bounds the work a short prefix can cause.
+MAX_PREFIX_TERMS = 512
+# Shorter query words match too much of the vocabulary to be useful.
+MIN_PREFIX_CHARS = 2
+# Notes scored per lookup, so its cost does not grow with the number of notes.
+MAX_CANDIDATES = 1000
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class PrefixIndex:
+    """
+    In-memory word index over note contents for as-you-type suggestions.
+
+    Terms are kept in a sorted list, so all terms starting with a prefix are
+    one bisect away; each term maps to the notes containing it, in the order
+    they were written, so the newest notes are read first. Notes are added,
+    replaced and removed one at a time, and the whole index is rebuilt from
+    the stored notes at startup, on a background thread; `ready` turns True
+    once that is done.
+    """
+
+    def __init__(self):
+        self._terms: List[str] = []
+        # Dicts used as insertion-ordered sets.
+        self._postings: Dict[str, Dict[str, None]] = {}
+        self._doc_terms: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.ready = False
+        # Notes written while a build runs; their current terms replace what the build read.
+        self._touched: Optional[Set[str]] = None
+
+    def build(self, docs) -> None:
+        """
+        Replaces the index contents with `docs`, oldest first, sorting the
+        term list once. `add`/`remove` calls made meanwhile are kept.
+        """
+        with self._lock:
+            self._touched = set()
+        postings: Dict[str, Dict[str, None]] = {}
+        doc_terms: Dict[str, Set[str]] = {}
+        for doc in docs:
+            terms = set(tokenize(doc.content))
+            doc_terms[doc.id] = terms
+            for term in terms:
+                postings.setdefault(term, {})[doc.id] = None
+        with self._lock:
+            current = self._doc_terms
+            touched, self._touched = self._touched, None
+            self._postings = postings
+            self._doc_terms = doc_terms
+            self._terms = sorted(postings)
+            for doc_id in touched:
+                self._remove(doc_id)
+                if doc_id in current:
+                    self._insert(doc_id, current[doc_id])
+            self.ready = True
+
+    def _remove(self, doc_id: str):
+        for term in self._doc_terms.pop(doc_id, ()):
+            posting = self._postings[term]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def _insert(self, doc_id: str, terms: Set[str]):
+        self._doc_terms[doc_id] = terms
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            posting[doc_id] = None
+
+    def add(self, doc_id: str, text: str) -> None:
+        terms = set(tokenize(text))
+        with self._lock:
+            self._remove(doc_id)
+            self._insert(doc_id, terms)
+            if self._touched is not None:
+                self._touched.add(doc_id)
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._remove(doc_id)
+            if self._touched is not None:
+                self._touched.add(doc_id)
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def _matching_terms(self, prefix: str) -> List[str]:
+        # The word itself sorts first when it is a term.
+        terms = []
+        start = bisect.bisect_left(self._terms, prefix)
+        for term in self._terms[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _candidates(self, words: List[str], matches: Dict[str, List[str]]) -> Set[str]:
+        # Rarest word first: its notes are the likeliest to match the whole query. Newest notes first.
+        rarest_first = sorted(words, key=lambda word: sum(len(self._postings[term]) for term in matches[word]))
+        found = set()
+        for word in rarest_first:
+            for term in matches[word]:
+                for doc_id in reversed(self._postings[term]):
+                    found.add(doc_id)
+                    if len(found) >= MAX_CANDIDATES:
+                        return found
+        return found
+
+    def search(self, query: str, k: int,
+               recency: Optional[Callable[[List[str]], List[float]]] = None) -> List[Tuple[str, float]]:
+        """
+        Notes whose words start with the query's words, as (doc id, score)
+        with the score the fraction of query words matched, best first.
+        Whole-word matches rank above prefix matches; `recency` gives the
+        timestamps that break ties, newest first. Words shorter than
+        MIN_PREFIX_CHARS are ignored, and at most MAX_CANDIDATES notes are
+        scored.
+        """
+        words = [word for word in dict.fromkeys(tokenize(query)) if len(word) >= MIN_PREFIX_CHARS]
+        if not words:
+            return []
+        scores: Dict[str, float] = {}
+        with self._lock:
+            matches = {word: self._matching_terms(word) for word in words}
+            term_sets = {word: set(terms) for word, terms in matches.items()}
+            for doc_id in self._candidates(words, matches):
+                doc_terms = self._doc_terms[doc_id]
+                score = 0.0
+                for word in words:
+                    if not term_sets[word].isdisjoint(doc_terms):
+                        score += 1.5 if word in doc_terms else 1.0
+                scores[doc_id] = score
+        times = dict(zip(scores, recency(list(scores)))) if recency is not None and scores else {}
+        ranked = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], times.get(item[0], 0.0)))
+        return [(doc_id, score / (1.5 * len(words))) for doc_id, score in ranked]
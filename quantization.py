@@ -0,0 +1,93 @@
+from typing import Optional
+import numpy as np
+
+QUANTIZATIONS = ("int8", "binary")
+# int8 steps are set from this quantile of |value| per dimension, so rare outliers do not waste the range.
+INT8_CLIP_QUANTILE = 99.9
+ENCODE_CHUNK_ROWS = 8192
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_TABLE[values]
+
+
+class Quantizer:
+    """
+    Compact codes for unit vectors, used to shortlist candidates before an
+    exact rescoring pass.
+
+    `int8` stores each dimension as a signed byte with a per-dimension step
+    (4x smaller than float32); the approximate score is the dot product of
+    the decoded codes with the query. `binary` keeps one bit per dimension,
+    set when the value is above that dimension's mean (32x smaller); the
+    score is `dim - 2 * hamming distance` to the query's bits.
+    """
+
+    def __init__(self, kind: str, dim: int, params: np.ndarray):
+        if kind not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{kind}', expected one of {QUANTIZATIONS}.")
+        self.kind = kind
+        self.dim = dim
+        # int8: step per dimension; binary: threshold per dimension.
+        self.params = np.asarray(params, dtype=np.float32)
+
+    @classmethod
+    def train(cls, kind: str, sample: np.ndarray) -> "Quantizer":
+        sample = np.asarray(sample, dtype=np.float32)
+        if kind == "int8":
+            max_abs = np.percentile(np.abs(sample), INT8_CLIP_QUANTILE, axis=0) if len(sample) else np.ones(sample.shape[1])
+            params = np.maximum(max_abs, 1e-6) / 127.0
+        else:
+            params = sample.mean(axis=0) if len(sample) else np.zeros(sample.shape[1])
+        return cls(kind, sample.shape[1], params)
+
+    @classmethod
+    def from_json(cls, value: Optional[dict]) -> Optional["Quantizer"]:
+        if not value:
+            return None
+        return cls(value["kind"], value["dim"], np.array(value["params"], dtype=np.float32))
+
+    def to_json(self) -> dict:
+        return {"kind": self.kind, "dim": self.dim, "params": self.params.tolist()}
+
+    @property
+    def code_shape(self):
+        return (self.dim,) if self.kind == "int8" else ((self.dim + 7) // 8,)
+
+    @property
+    def code_dtype(self):
+        return np.int8 if self.kind == "int8" else np.uint8
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors)
+        codes = np.empty((vectors.shape[0],) + self.code_shape, dtype=self.code_dtype)
+        for start in range(0, vectors.shape[0], ENCODE_CHUNK_ROWS):
+            chunk = vectors[start:start + ENCODE_CHUNK_ROWS].astype(np.float32)
+            if self.kind == "int8":
+                codes[start:start + chunk.shape[0]] = np.clip(np.rint(chunk / self.params), -127, 127)
+            else:
+                codes[start:start + chunk.shape[0]] = np.packbits(chunk > self.params, axis=1)
+        return codes
+
+    def prepare(self, query: np.ndarray):
+        """Per-query form used by `score`."""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if self.kind == "int8":
+            return query * self.params
+        return np.packbits(query > self.params)
+
+    def score(self, codes: np.ndarray, prepared) -> np.ndarray:
+        """Approximate similarity of every code to the prepared query; higher is closer."""
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], ENCODE_CHUNK_ROWS):
+            chunk = codes[start:start + ENCODE_CHUNK_ROWS]
+            if self.kind == "int8":
+                scores[start:start + chunk.shape[0]] = chunk.astype(np.float32) @ prepared
+            else:
+                hamming = _popcount(np.bitwise_xor(chunk, prepared)).sum(axis=1, dtype=np.int32)
+                scores[start:start + chunk.shape[0]] = self.dim - 2 * hamming
+        return scores
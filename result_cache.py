@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from typing import Hashable, Optional
+import threading
+
+DEFAULT_MAX_ENTRIES = 256
+
+
+class ResultCache:
+    """
+    An LRU of ranked search results, keyed by the normalized query and the
+    search parameters.
+
+    Every entry is stamped with the store generation it was computed at. The
+    store bumps its generation after each write, so an entry from an older
+    generation is dropped on lookup instead of being served.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key: Hashable, generation: int) -> Optional[list]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != generation:
+                del self._entries[key]
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, generation: int, results: list) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (generation, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "entries": len(self._entries)}
@@ -0,0 +1,79 @@
+from typing import Callable, List, Optional
+import queue
+import threading
+import logging
+
+SearchFunction = Callable[[str, int, float, Callable[[], bool]], List]
+
+
+class SearchExecutor:
+    """
+    Runs searches on a worker thread, newest request first.
+
+    Every `submit()` starts a new generation. Only the latest request waits to
+    run; older ones that have not started are dropped, and one already running
+    is told through its `cancelled()` callback that its results are no longer
+    wanted. Finished results are handed back by `poll()`, which the UI thread
+    calls from its event loop, and only for the current generation.
+    """
+
+    def __init__(self, search_fn: SearchFunction):
+        self.search_fn = search_fn
+        self._generation = 0
+        self._request = None
+        self._results = queue.Queue()
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, query: str, k: int, min_similarity_threshold: float,
+               on_result: Callable[[List], None]) -> int:
+        with self._condition:
+            self._generation += 1
+            self._request = (self._generation, query, k, min_similarity_threshold, on_result)
+            self._condition.notify_all()
+            return self._generation
+
+    def cancel(self) -> None:
+        """Drops the pending request and any results that have not been delivered yet."""
+        with self._condition:
+            self._generation += 1
+            self._request = None
+
+    def is_current(self, generation: int) -> bool:
+        return generation == self._generation
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and self._request is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                generation, query, k, threshold, on_result = self._request
+                self._request = None
+            try:
+                results = self.search_fn(query, k, threshold, lambda: not self.is_current(generation))
+            except Exception as e:
+                logging.error(f"Search for '{query[:50]}' failed: {e}")
+                continue
+            if self.is_current(generation):
+                self._results.put((generation, results, on_result))
+
+    def poll(self) -> None:
+        """Delivers finished results on the calling thread; stale ones are discarded."""
+        while True:
+            try:
+                generation, results, on_result = self._results.get_nowait()
+            except queue.Empty:
+                return
+            if self.is_current(generation):
+                on_result(results)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        with self._condition:
+            self._running = False
+            self._request = None
+            self._condition.notify_all()
+        self._thread.join(timeout)
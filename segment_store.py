@@ -0,0 +1,733 @@
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import json
+import os
+import re
+import struct
+import threading
+import logging
+
+from quantization import Quantizer
+
+MANIFEST_NAME = "manifest.json"
+SEGMENT_FOLDER_NAME = "segments"
+DEFAULT_SEGMENT_ROWS = 4096
+DEFAULT_MAX_SEGMENTS = 8
+DEFAULT_MAX_DEAD_RATIO = 0.3
+DEFAULT_DTYPE = np.float16
+COPY_CHUNK_ROWS = 8192
+
+_RECORD_HEADER = struct.Struct("<cH")
+_OP_ADD = b"A"
+_OP_DELETE = b"D"
+_WAL_PATTERN = re.compile(r"wal-(\d+)\.log")
+
+
+def _grow(arr: np.ndarray, min_rows: int) -> np.ndarray:
+    if arr.shape[0] >= min_rows:
+        return arr
+    new_rows = max(min_rows, 2 * arr.shape[0], 16)
+    grown = np.zeros((new_rows,) + arr.shape[1:], dtype=arr.dtype)
+    grown[:arr.shape[0]] = arr
+    return grown
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """L2-normalizes each row in float32; all-zero rows are left as zeros."""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 1e-9)
+    return vectors
+
+
+def _write_json(path: str, value) -> None:
+    with open(path, "w", encoding='utf-8') as f:
+        json.dump(value, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ReadOnlyStoreError(RuntimeError):
+    """Raised by writes to a store opened read-only, e.g. while another process holds its write lock."""
+
+
+class Segment:
+    """An immutable block of vectors and the doc ids of its rows, as written to disk."""
+
+    def __init__(self, name: str, vectors: np.ndarray, ids: List[str], deleted=()):
+        self.name = name
+        self.vectors = vectors
+        self.ids = ids
+        self.deleted = set(deleted)
+        # Quantized codes of the rows, when the store has a quantizer.
+        self.codes: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Snapshot:
+    """
+    A consistent read-only view of the store at one point in time.
+
+    Segments are immutable and the unsealed tail is only ever appended to, so
+    a snapshot shares their arrays and copies just the live mask. Readers
+    score against it without holding the store lock while writes go on.
+    With a quantizer, `code_blocks` holds the codes matching `blocks`.
+    """
+
+    def __init__(self, blocks: List[Tuple[int, np.ndarray]], live: np.ndarray, row_ids: List[str], dim: int,
+                 quantizer: Optional[Quantizer] = None, code_blocks: Optional[List[Tuple[int, np.ndarray]]] = None):
+        self.blocks = blocks
+        self.live = live
+        self.row_ids = row_ids
+        self.dim = dim
+        self.quantizer = quantizer
+        self.code_blocks = code_blocks
+
+    @property
+    def row_count(self) -> int:
+        return self.live.shape[0]
+
+    def doc_id_at(self, row: int) -> str:
+        return self.row_ids[row]
+
+    def gather(self, rows) -> np.ndarray:
+        """float32 copies of the given rows, in the order given."""
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty((rows.shape[0], self.dim), dtype=np.float32)
+        for start, block in self.blocks:
+            mask = (rows >= start) & (rows < start + block.shape[0])
+            if np.any(mask):
+                result[mask] = block[rows[mask] - start]
+        return result
+
+
+class SegmentStore:
+    """
+    Append-only vector storage.
+
+    Vectors live in immutable segment files plus an append log that holds the
+    rows written since the last seal. Deletes and updates never rewrite a
+    segment: the superseded row is tombstoned and skipped by readers until
+    `compact()` merges the segments and drops the dead rows.
+
+    Every stored vector is L2-normalized on write, so cosine similarity is a
+    plain dot product against the stored rows.
+
+    `set_quantization()` adds int8 or binary codes of every row, kept in a
+    file next to each segment, for a cheap first pass over the whole store.
+
+    A `read_only` store loads what is on disk without repairing or cleaning
+    up anything, since another process may be writing it at the same time.
+    """
+
+    def __init__(self, db_dir: str, dim: int = 1024, segment_rows: int = DEFAULT_SEGMENT_ROWS,
+                 max_segments: int = DEFAULT_MAX_SEGMENTS, max_dead_ratio: float = DEFAULT_MAX_DEAD_RATIO,
+                 auto_compact: bool = True, dtype=DEFAULT_DTYPE, mmap: bool = True, read_only: bool = False):
+        self.db_dir = db_dir
+        self.segment_folder = os.path.join(db_dir, SEGMENT_FOLDER_NAME)
+        self.manifest_file = os.path.join(db_dir, MANIFEST_NAME)
+        self.dim = dim
+        # Only used for new stores; an existing store keeps the dtype recorded in its manifest.
+        self.dtype = np.dtype(dtype)
+        self.mmap = mmap
+        self.normalized = True
+        self.segment_rows = segment_rows
+        self.max_segments = max_segments
+        self.max_dead_ratio = max_dead_ratio
+        self.auto_compact = auto_compact
+        self.read_only = read_only
+        os.makedirs(self.segment_folder, exist_ok=True)
+
+        self.lock = threading.RLock()
+        # Lock order: _compact_lock, _seal_lock, _wal_lock, lock.
+        self._compact_lock = threading.Lock()
+        self._seal_lock = threading.Lock()
+        self._wal_lock = threading.Lock()
+        self._compact_thread = None
+
+        self.segments: List[Segment] = []
+        self.index: Dict[str, int] = {}
+        self._row_ids: List[str] = []
+        self._live = np.zeros(0, dtype=bool)
+        self._mem_vectors = np.zeros((0, dim), dtype=self.dtype)
+        self._mem_count = 0
+        self.quantizer: Optional[Quantizer] = None
+        self._mem_codes = None
+        self._mem_codes_count = 0
+        self._next_segment = 1
+        self._wal_generation = 1
+        # Oldest log whose rows are not all in segments yet; the manifest records it.
+        self._wal_start = 1
+        self._wal = None
+
+        if read_only:
+            self._open_read_only()
+        else:
+            self._open()
+
+    # --- Loading ---
+
+    def _reset(self):
+        self.segments = []
+        self.index = {}
+        self._row_ids = []
+        self._live = np.zeros(0, dtype=bool)
+        self._mem_vectors = np.zeros((0, self.dim), dtype=self.dtype)
+        self._mem_count = 0
+        self._mem_codes = None
+        self._mem_codes_count = 0
+
+    def _read_manifest(self) -> Optional[str]:
+        try:
+            with open(self.manifest_file, "r", encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _open_read_only(self, attempts: int = 5):
+        # The writer may seal or compact while we load; retry until the manifest held still.
+        for _ in range(attempts):
+            before = self._read_manifest()
+            self._reset()
+            self._load_manifest(before)
+            self._replay_wal()
+            if self._read_manifest() == before:
+                return
+        logging.warning(f"{self.db_dir} kept changing while it was opened; the view may be incomplete.")
+
+    def _load_manifest(self, text: Optional[str]):
+        if text is not None:
+            manifest = json.loads(text)
+            self.dim = manifest.get("dim", self.dim)
+            self.dtype = np.dtype(manifest.get("dtype", self.dtype.name))
+            self._mem_vectors = np.zeros((0, self.dim), dtype=self.dtype)
+            self._next_segment = manifest.get("next_segment", 1)
+            self._wal_start = self._wal_generation = manifest.get("wal_generation", 1)
+            # Stores written before vectors were normalized are upgraded by the next compaction.
+            self.normalized = manifest.get("normalized", False)
+            self.quantizer = Quantizer.from_json(manifest.get("quantization"))
+            for entry in manifest.get("segments", []):
+                segment = self._load_segment(entry["name"], entry.get("deleted", ()))
+                if segment is not None:
+                    self._attach_segment(segment)
+
+    def _open(self):
+        self._load_manifest(self._read_manifest())
+        self._remove_orphans()
+        self._replay_wal()
+        self._wal = open(self._wal_path(self._wal_generation), "ab")
+        if not self.normalized:
+            if self.row_count:
+                logging.info(f"Normalizing the stored vectors in {self.db_dir}.")
+                self.compact()
+            else:
+                self.normalized = True
+
+    def _load_segment(self, name: str, deleted) -> Optional[Segment]:
+        vec_path, ids_path = self._segment_paths(name)
+        try:
+            vectors = np.load(vec_path, mmap_mode='r' if self.mmap else None)
+            with open(ids_path, "r", encoding='utf-8') as f:
+                ids = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not load segment {name}: {e}. Its rows will be missing from the store.")
+            return None
+        if vectors.shape[0] != len(ids):
+            logging.error(f"Segment {name} has {vectors.shape[0]} vectors but {len(ids)} ids. Skipping it.")
+            return None
+        segment = Segment(name, vectors, ids, deleted)
+        if self.quantizer is not None:
+            segment.codes = self._segment_codes(segment, self.quantizer)
+        return segment
+
+    def _segment_codes(self, segment: Segment, quantizer: Quantizer, fresh: bool = False) -> np.ndarray:
+        """The segment's codes from the file next to it, encoded and written first if missing or `fresh`."""
+        path = self._codes_path(segment.name, quantizer.kind)
+        if not fresh and os.path.exists(path):
+            try:
+                codes = np.load(path, mmap_mode='r' if self.mmap else None)
+                if codes.shape == (len(segment),) + quantizer.code_shape:
+                    return codes
+            except (OSError, ValueError) as e:
+                logging.warning(f"Re-encoding unreadable codes {path}: {e}")
+        codes = quantizer.encode(segment.vectors)
+        if self.read_only:
+            return codes
+        # Written under a new name, so snapshots still mapping the old file keep valid pages.
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, codes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r') if self.mmap else codes
+
+    def _attach_segment(self, segment: Segment):
+        start = len(self._row_ids)
+        self._row_ids.extend(segment.ids)
+        self._live = _grow(self._live, len(self._row_ids))
+        for local_row, doc_id in enumerate(segment.ids):
+            row = start + local_row
+            if local_row in segment.deleted:
+                continue
+            self._supersede(doc_id)
+            self.index[doc_id] = row
+            self._live[row] = True
+        self.segments.append(segment)
+
+    def _remove_orphans(self):
+        # Files left behind by an interrupted compaction, or that could not be removed while still mapped.
+        known = {path for segment in self.segments for path in self._segment_paths(segment.name)}
+        if self.quantizer is not None:
+            known.update(self._codes_path(segment.name, self.quantizer.kind) for segment in self.segments)
+        for file_name in os.listdir(self.segment_folder):
+            path = os.path.join(self.segment_folder, file_name)
+            if path not in known:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.warning(f"Could not remove orphaned segment file {path}: {e}")
+        self._remove_sealed_logs()
+
+    def _log_generations(self) -> List[int]:
+        generations = []
+        for file_name in os.listdir(self.db_dir):
+            match = _WAL_PATTERN.fullmatch(file_name)
+            if match:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+    def _remove_sealed_logs(self):
+        for generation in self._log_generations():
+            if generation < self._wal_start:
+                path = self._wal_path(generation)
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.warning(f"Could not remove sealed log {path}: {e}")
+
+    def _replay_wal(self):
+        # A seal that was interrupted leaves the log it rotated away from next to the new one.
+        for generation in self._log_generations():
+            if generation >= self._wal_start:
+                self._replay_log(self._wal_path(generation))
+                self._wal_generation = generation
+
+    def _replay_log(self, wal_path: str):
+        vector_bytes = self.dim * self.dtype.itemsize
+        with open(wal_path, "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + _RECORD_HEADER.size <= len(data):
+            op, id_len = _RECORD_HEADER.unpack_from(data, pos)
+            end = pos + _RECORD_HEADER.size + id_len + (vector_bytes if op == _OP_ADD else 0)
+            if end > len(data) or op not in (_OP_ADD, _OP_DELETE):
+                break
+            id_start = pos + _RECORD_HEADER.size
+            doc_id = data[id_start:id_start + id_len].decode('utf-8')
+            if op == _OP_ADD:
+                vector = np.frombuffer(data, dtype=self.dtype, count=self.dim, offset=id_start + id_len)
+                self._append_row(doc_id, vector)
+            else:
+                self._supersede(doc_id)
+                self.index.pop(doc_id, None)
+            pos = end
+        if pos < len(data) and not self.read_only:
+            logging.warning(f"Discarding {len(data) - pos} bytes of incomplete records at the end of {wal_path}.")
+            with open(wal_path, "r+b") as f:
+                f.truncate(pos)
+
+    # --- Paths and persistence ---
+
+    def _segment_paths(self, name: str) -> Tuple[str, str]:
+        base = os.path.join(self.segment_folder, name)
+        return base + ".npy", base + ".ids.json"
+
+    def _codes_path(self, name: str, kind: str) -> str:
+        return os.path.join(self.segment_folder, f"{name}.{kind}.npy")
+
+    def _wal_path(self, generation: int) -> str:
+        return os.path.join(self.db_dir, f"wal-{generation:06d}.log")
+
+    def _write_segment(self, name: str, vectors: np.ndarray, ids: List[str]):
+        vec_path, ids_path = self._segment_paths(name)
+        with open(vec_path, "wb") as f:
+            np.save(f, vectors)
+            f.flush()
+            os.fsync(f.fileno())
+        _write_json(ids_path, ids)
+
+    def _write_manifest(self):
+        manifest = {
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "next_segment": self._next_segment,
+            "wal_generation": self._wal_start,
+            "normalized": self.normalized,
+            "quantization": self.quantizer.to_json() if self.quantizer is not None else None,
+            "segments": [{"name": s.name, "rows": len(s), "deleted": sorted(s.deleted)} for s in self.segments],
+        }
+        # Replacing the manifest is the commit: segments it does not list are orphans.
+        tmp_path = self.manifest_file + ".tmp"
+        _write_json(tmp_path, manifest)
+        os.replace(tmp_path, self.manifest_file)
+
+    def _new_segment_name(self) -> str:
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        return name
+
+    def _log(self, op: bytes, doc_id: str, vector: Optional[np.ndarray] = None):
+        encoded_id = doc_id.encode('utf-8')
+        self._wal.write(_RECORD_HEADER.pack(op, len(encoded_id)) + encoded_id)
+        if vector is not None:
+            self._wal.write(vector.tobytes())
+        self._wal.flush()
+
+    # --- Row bookkeeping ---
+
+    @property
+    def row_count(self) -> int:
+        return len(self._row_ids)
+
+    @property
+    def sealed_rows(self) -> int:
+        return self.row_count - self._mem_count
+
+    def _supersede(self, doc_id: str):
+        row = self.index.get(doc_id)
+        if row is None:
+            return
+        self._live[row] = False
+        if row < self.sealed_rows:
+            for segment, start in self._segment_starts():
+                if start <= row < start + len(segment):
+                    segment.deleted.add(row - start)
+                    break
+
+    def _segment_starts(self):
+        start = 0
+        for segment in self.segments:
+            yield segment, start
+            start += len(segment)
+
+    def _append_row(self, doc_id: str, vector: np.ndarray):
+        self._supersede(doc_id)
+        row = self.row_count
+        self._mem_vectors = _grow(self._mem_vectors, self._mem_count + 1)
+        self._mem_vectors[self._mem_count] = vector
+        self._mem_count += 1
+        self._row_ids.append(doc_id)
+        self._live = _grow(self._live, self.row_count)
+        self._live[row] = True
+        self.index[doc_id] = row
+
+    def _append_rows(self, doc_ids: List[str], vectors: np.ndarray):
+        start = self.row_count
+        self._mem_vectors = _grow(self._mem_vectors, self._mem_count + len(doc_ids))
+        self._mem_vectors[self._mem_count:self._mem_count + len(doc_ids)] = vectors
+        self._mem_count += len(doc_ids)
+        self._row_ids.extend(doc_ids)
+        self._live = _grow(self._live, self.row_count)
+        self._live[start:self.row_count] = True
+        for row, doc_id in enumerate(doc_ids, start):
+            self._supersede(doc_id)
+            self.index[doc_id] = row
+
+    # --- Public API ---
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.index
+
+    def doc_id_at(self, row: int) -> str:
+        return self._row_ids[row]
+
+    def live_mask(self) -> np.ndarray:
+        return self._live[:self.row_count]
+
+    def snapshot(self) -> Snapshot:
+        with self.lock:
+            code_blocks = None
+            if self.quantizer is not None:
+                code_blocks = [(start, segment.codes) for segment, start in self._segment_starts()]
+                if self._mem_count:
+                    code_blocks.append((self.sealed_rows, self._tail_codes()))
+            return Snapshot(self.blocks(), self.live_mask().copy(), self._row_ids, self.dim,
+                            self.quantizer, code_blocks)
+
+    def _tail_codes(self) -> np.ndarray:
+        # Rows of the unsealed tail are encoded on first use, then reused by later snapshots.
+        if self._mem_codes is None:
+            self._mem_codes = np.zeros((0,) + self.quantizer.code_shape, dtype=self.quantizer.code_dtype)
+        if self._mem_codes_count < self._mem_count:
+            self._mem_codes = _grow(self._mem_codes, self._mem_count)
+            new_rows = slice(self._mem_codes_count, self._mem_count)
+            self._mem_codes[new_rows] = self.quantizer.encode(self._mem_vectors[new_rows])
+            self._mem_codes_count = self._mem_count
+        return self._mem_codes[:self._mem_count]
+
+    def set_quantization(self, kind: Optional[str], sample: Optional[np.ndarray] = None) -> None:
+        """
+        Trains `kind` ("int8" or "binary") codes on a sample of stored vectors
+        and writes them for every segment. The parameters are saved in the
+        manifest, so new segments are encoded the same way. None drops them.
+        """
+        self._check_writable()
+        quantizer = Quantizer.train(kind, sample) if kind is not None else None
+        with self._compact_lock:
+            with self.lock:
+                old = self.quantizer
+                segments = list(self.segments)
+            codes = {}
+            if quantizer is not None:
+                for segment in segments:
+                    codes[segment.name] = self._segment_codes(segment, quantizer, fresh=True)
+            with self.lock:
+                self.quantizer = quantizer
+                for segment in self.segments:
+                    segment.codes = codes.get(segment.name)
+                    if quantizer is not None and segment.codes is None:
+                        # Sealed while the others were being encoded.
+                        segment.codes = self._segment_codes(segment, quantizer, fresh=True)
+                self._mem_codes = None
+                self._mem_codes_count = 0
+                self._write_manifest()
+            if old is not None and (quantizer is None or quantizer.kind != old.kind):
+                for segment in segments:
+                    try:
+                        os.remove(self._codes_path(segment.name, old.kind))
+                    except OSError as e:
+                        logging.warning(f"Could not remove old {old.kind} codes of {segment.name}: {e}")
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ReadOnlyStoreError(f"{self.db_dir} is open read-only.")
+
+    def blocks(self) -> List[Tuple[int, np.ndarray]]:
+        """(first row, vectors) for every segment and the unsealed tail, in row order."""
+        blocks = [(start, segment.vectors) for segment, start in self._segment_starts()]
+        if self._mem_count:
+            blocks.append((self.sealed_rows, self._mem_vectors[:self._mem_count]))
+        return blocks
+
+    def gather(self, rows) -> np.ndarray:
+        """float32 copies of the given rows, in the order given."""
+        with self.lock:
+            return Snapshot(self.blocks(), self._live, self._row_ids, self.dim).gather(rows)
+
+    def put(self, doc_id: str, vector) -> None:
+        vector = normalize_rows(vector).astype(self.dtype).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a vector of dimension {self.dim}, got {vector.shape[0]}.")
+        self._check_writable()
+        with self._wal_lock:
+            self._log(_OP_ADD, doc_id, vector)
+            with self.lock:
+                self._append_row(doc_id, vector)
+                full = self._mem_count >= self.segment_rows
+        if full:
+            self._seal()
+
+    def put_many(self, doc_ids: List[str], vectors) -> None:
+        """Append several rows with a single log write."""
+        vectors = normalize_rows(np.asarray(vectors).reshape(len(doc_ids), -1)).astype(self.dtype)
+        if len(doc_ids) and vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}.")
+        self._check_writable()
+        records = []
+        for doc_id, vector in zip(doc_ids, vectors):
+            encoded_id = doc_id.encode('utf-8')
+            records.append(_RECORD_HEADER.pack(_OP_ADD, len(encoded_id)) + encoded_id + vector.tobytes())
+        # Searches only wait for the in-memory append, not for the log write.
+        with self._wal_lock:
+            self._wal.write(b"".join(records))
+            self._wal.flush()
+            with self.lock:
+                self._append_rows(list(doc_ids), vectors)
+                full = self._mem_count >= self.segment_rows
+        if full:
+            self._seal()
+
+    def delete(self, doc_id: str) -> bool:
+        self._check_writable()
+        with self._wal_lock:
+            with self.lock:
+                if doc_id not in self.index:
+                    return False
+            self._log(_OP_DELETE, doc_id)
+            with self.lock:
+                self._supersede(doc_id)
+                self.index.pop(doc_id)
+                self._maybe_compact()
+            return True
+
+    def flush(self) -> None:
+        """Seal the append log into new immutable segments."""
+        self._check_writable()
+        self._seal()
+
+    def sync(self) -> None:
+        """fsyncs the append log so every write so far survives a crash."""
+        if self.read_only:
+            return
+        with self._wal_lock:
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+
+    def _seal(self, allow_compact: bool = True):
+        """
+        Writes the unsealed tail out as segments of at most `segment_rows`
+        rows. The lock is held only to take the rows and to swap the new
+        segments and manifest in; writing and encoding the files runs without
+        it, so searches keep going. Rows added meanwhile go to a new log.
+        """
+        with self._seal_lock:
+            with self._wal_lock, self.lock:
+                count = self._mem_count
+                if not count and not any(segment.deleted for segment in self.segments):
+                    return
+                # The tail is append-only, so this view keeps its rows while the lock is released.
+                vectors = self._mem_vectors[:count]
+                ids = self._row_ids[self.sealed_rows:self.row_count]
+                names = [self._new_segment_name() for _ in range(0, count, self.segment_rows)]
+                quantizer = self.quantizer
+                self._wal.close()
+                self._wal_generation += 1
+                self._wal = open(self._wal_path(self._wal_generation), "ab")
+                wal_start = self._wal_generation
+
+            segments = []
+            for i, name in enumerate(names):
+                rows = slice(i * self.segment_rows, (i + 1) * self.segment_rows)
+                self._write_segment(name, vectors[rows], ids[rows])
+                if self.mmap:
+                    segment_vectors = np.load(self._segment_paths(name)[0], mmap_mode='r')
+                else:
+                    segment_vectors = vectors[rows].copy()
+                segment = Segment(name, segment_vectors, ids[rows])
+                if quantizer is not None:
+                    segment.codes = self._segment_codes(segment, quantizer, fresh=True)
+                segments.append(segment)
+
+            with self.lock:
+                # Compaction may have replaced the sealed rows meanwhile; the tail still starts the same way.
+                start = self.sealed_rows
+                for segment in segments:
+                    segment.deleted = set(np.flatnonzero(~self._live[start:start + len(segment)]).tolist())
+                    start += len(segment)
+                    if self.quantizer is not quantizer:
+                        segment.codes = None
+                        if self.quantizer is not None:
+                            segment.codes = self._segment_codes(segment, self.quantizer, fresh=True)
+                self.segments.extend(segments)
+                self._mem_vectors = self._mem_vectors[count:self._mem_count].copy()
+                if self._mem_codes is not None and self._mem_codes_count > count:
+                    self._mem_codes = self._mem_codes[count:self._mem_codes_count].copy()
+                    self._mem_codes_count -= count
+                else:
+                    self._mem_codes = None
+                    self._mem_codes_count = 0
+                self._mem_count -= count
+                self._wal_start = wal_start
+                self._write_manifest()
+            self._remove_sealed_logs()
+        if allow_compact:
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if not self.auto_compact or self.row_count == 0:
+            return
+        dead_ratio = 1.0 - len(self.index) / self.row_count
+        if len(self.segments) > self.max_segments or dead_ratio > self.max_dead_ratio:
+            self.compact_async()
+
+    def compact_async(self) -> threading.Thread:
+        """Run `compact()` on a background thread, unless one is already running."""
+        with self.lock:
+            if self._compact_thread is None or not self._compact_thread.is_alive():
+                self._compact_thread = threading.Thread(target=self._compact_in_background, daemon=True)
+                self._compact_thread.start()
+            return self._compact_thread
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logging.error(f"Background compaction failed: {e}")
+
+    def compact(self) -> None:
+        """Merge all segments into one, dropping tombstoned rows."""
+        self._check_writable()
+        with self._compact_lock:
+            self._seal(allow_compact=False)
+            with self.lock:
+                merged = list(self.segments)
+                merged_rows = self.sealed_rows
+                keep = np.flatnonzero(self._live[:merged_rows])
+                if len(merged) <= 1 and len(keep) == merged_rows and self.normalized:
+                    return
+                ids = [self._row_ids[row] for row in keep]
+                name = self._new_segment_name()
+                quantizer = self.quantizer
+
+            # Segments are immutable, so the merge itself runs without holding the lock.
+            # Rows are copied segment by segment into the new file, never all at once.
+            vec_path, ids_path = self._segment_paths(name)
+            out = np.lib.format.open_memmap(vec_path, mode='w+', dtype=self.dtype, shape=(len(keep), self.dim))
+            written = 0
+            start = 0
+            for segment in merged:
+                local_keep = keep[(keep >= start) & (keep < start + len(segment))] - start
+                for chunk_start in range(0, len(local_keep), COPY_CHUNK_ROWS):
+                    rows = local_keep[chunk_start:chunk_start + COPY_CHUNK_ROWS]
+                    out[written:written + len(rows)] = normalize_rows(segment.vectors[rows])
+                    written += len(rows)
+                start += len(segment)
+            out.flush()
+            del out
+            with open(vec_path, "rb+") as f:
+                os.fsync(f.fileno())
+            _write_json(ids_path, ids)
+            vectors = np.load(vec_path, mmap_mode='r' if self.mmap else None)
+            codes = None
+            if quantizer is not None:
+                codes = self._segment_codes(Segment(name, vectors, ids), quantizer, fresh=True)
+
+            with self.lock:
+                # Rows may have been superseded while the merge was running.
+                still_live = self._live[:merged_rows][keep]
+                segment = Segment(name, vectors, ids, np.flatnonzero(~still_live).tolist())
+                segment.codes = codes
+                tail_ids = self._row_ids[merged_rows:]
+                tail_live = self._live[merged_rows:self.row_count]
+                self.segments = [segment] + self.segments[len(merged):]
+                self._row_ids = ids + tail_ids
+                self._live = np.concatenate([still_live, tail_live])
+                self.index = {doc_id: row for row, doc_id in enumerate(self._row_ids) if self._live[row]}
+                self.normalized = True
+                self._write_manifest()
+
+            for old in merged:
+                paths = list(self._segment_paths(old.name))
+                if quantizer is not None:
+                    paths.append(self._codes_path(old.name, quantizer.kind))
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        # Still mapped somewhere (e.g. on Windows); it is cleaned up on the next open.
+                        logging.warning(f"Could not remove compacted segment file {path}: {e}")
+
+    def close(self) -> None:
+        thread = self._compact_thread
+        if thread is not None:
+            thread.join()
+        with self._wal_lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
@@ -0,0 +1,259 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import heapq
+import json
+import os
+import threading
+import logging
+
+SPARSE_LOG_NAME = "sparse_index.log"
+SPARSE_SNAPSHOT_NAME = "sparse_index.npz"
+# The log is folded into a new snapshot once it holds this many entries plus an eighth of the index size.
+SNAPSHOT_LOG_ENTRIES = 1024
+
+
+class _Snapshot:
+    """
+    Every key's weights at the time of the last snapshot, as flat arrays:
+    by key (CSR rows) to score one passage, and by term to search.
+    """
+
+    def __init__(self, keys: np.ndarray, terms: np.ndarray, row_offsets: np.ndarray, row_terms: np.ndarray,
+                 row_weights: np.ndarray, term_offsets: np.ndarray, term_rows: np.ndarray,
+                 term_weights: np.ndarray):
+        self.keys = keys
+        self.terms = terms
+        self.row_offsets = row_offsets
+        self.row_terms = row_terms
+        self.row_weights = row_weights
+        self.term_offsets = term_offsets
+        self.term_rows = term_rows
+        self.term_weights = term_weights
+        self.rows = {key: row for row, key in enumerate(keys.tolist())}
+        self.term_ids = {term: i for i, term in enumerate(terms.tolist())}
+
+    @classmethod
+    def build(cls, keys: np.ndarray, terms: np.ndarray, row_offsets: np.ndarray, row_terms: np.ndarray,
+              row_weights: np.ndarray) -> "_Snapshot":
+        """From the by-key arrays; `terms` must be sorted and `row_terms` index into it."""
+        order = np.argsort(row_terms, kind='stable')
+        entry_rows = np.repeat(np.arange(len(keys), dtype=np.int32), np.diff(row_offsets))
+        term_offsets = np.searchsorted(row_terms[order], np.arange(len(terms) + 1)).astype(np.int64)
+        return cls(keys, terms, row_offsets, row_terms, row_weights, term_offsets, entry_rows[order],
+                   row_weights[order])
+
+    @classmethod
+    def empty(cls) -> "_Snapshot":
+        return cls.build(np.zeros(0, dtype=str), np.zeros(0, dtype=str), np.zeros(1, dtype=np.int64),
+                         np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path: str) -> Optional["_Snapshot"]:
+        try:
+            with np.load(path) as f:
+                return cls(f["keys"], f["terms"], f["row_offsets"], f["row_terms"], f["row_weights"],
+                           f["term_offsets"], f["term_rows"], f["term_weights"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Could not load {path}: {e}. Rebuilding it from the log.")
+            return None
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=self.keys, terms=self.terms, row_offsets=self.row_offsets, row_terms=self.row_terms,
+                     row_weights=self.row_weights, term_offsets=self.term_offsets, term_rows=self.term_rows,
+                     term_weights=self.term_weights)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def weights(self, row: int) -> Dict[str, float]:
+        entries = slice(self.row_offsets[row], self.row_offsets[row + 1])
+        return dict(zip(self.terms[self.row_terms[entries]].tolist(), self.row_weights[entries].tolist()))
+
+
+class SparseIndex:
+    """
+    Inverted index over lexical weights: term -> {key: weight}.
+
+    A key's score for a query is the sum over shared terms of query weight
+    times document weight, the lexical matching score of BGE-M3. Most keys
+    live in a snapshot of flat arrays that is loaded as is; keys written
+    since then are kept in dicts and in an append-only log, which is folded
+    into a new snapshot once it grows. So opening reads one file and replays
+    a short log. A `read_only` index never writes either file.
+    """
+
+    def __init__(self, db_dir: str, read_only: bool = False):
+        self.log_file = os.path.join(db_dir, SPARSE_LOG_NAME)
+        self.snapshot_file = os.path.join(db_dir, SPARSE_SNAPSHOT_NAME)
+        self._base = _Snapshot.load(self.snapshot_file) or _Snapshot.empty()
+        self._live = np.ones(len(self._base.keys), dtype=bool)
+        self._live_count = len(self._base.keys)
+        # Keys written since the snapshot.
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.forward: Dict[str, Dict[str, float]] = {}
+        self._log_entries = 0
+        self._lock = threading.Lock()
+        self._load()
+        self._log = None if read_only else open(self.log_file, "a", encoding='utf-8')
+        if not read_only and self._log_entries > self._log_limit():
+            # A log written before snapshots existed, or left long by the last run.
+            self._write_snapshot()
+
+    def _load(self):
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, "r", encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logging.warning(f"Skipping a corrupt line in {self.log_file}.")
+                    continue
+                self._log_entries += 1
+                if "w" in entry:
+                    self._set(entry["k"], entry["w"])
+                else:
+                    self._unset(entry["k"])
+
+    def _drop_base(self, key: str):
+        row = self._base.rows.get(key)
+        if row is not None and self._live[row]:
+            self._live[row] = False
+            self._live_count -= 1
+
+    def _set(self, key: str, weights: Dict[str, float]):
+        self._unset(key)
+        self.forward[key] = weights
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[key] = weight
+
+    def _unset(self, key: str):
+        self._drop_base(key)
+        weights = self.forward.pop(key, None)
+        if weights is None:
+            return
+        for term in weights:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[term]
+
+    def _log_limit(self) -> int:
+        return SNAPSHOT_LOG_ENTRIES + len(self) // 8
+
+    def _append_log(self, lines: List[str]):
+        self._log.writelines(lines)
+        self._log.flush()
+        self._log_entries += len(lines)
+        if self._log_entries > self._log_limit():
+            self._write_snapshot()
+
+    def _merged(self) -> _Snapshot:
+        base = self._base
+        live_rows = np.flatnonzero(self._live)
+        lengths = np.diff(base.row_offsets)[live_rows]
+        starts = base.row_offsets[live_rows]
+        kept_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        entries = np.arange(kept_offsets[-1]) - np.repeat(kept_offsets[:-1], lengths) + np.repeat(starts, lengths)
+
+        new_keys = list(self.forward)
+        new_terms = [term for key in new_keys for term in self.forward[key]]
+        new_weights = [weight for key in new_keys for weight in self.forward[key].values()]
+        new_lengths = [len(self.forward[key]) for key in new_keys]
+
+        kept_terms = base.terms[base.row_terms[entries]]
+        terms = np.unique(np.concatenate([kept_terms, np.array(new_terms, dtype=str)]))
+        row_terms = np.concatenate([np.searchsorted(terms, kept_terms),
+                                    np.searchsorted(terms, np.array(new_terms, dtype=str))]).astype(np.int32)
+        row_weights = np.concatenate([base.row_weights[entries],
+                                      np.array(new_weights, dtype=np.float32)]).astype(np.float32)
+        row_offsets = np.concatenate([kept_offsets, kept_offsets[-1] + np.cumsum(new_lengths, dtype=np.int64)])
+        keys = np.concatenate([base.keys[live_rows], np.array(new_keys, dtype=str)])
+        return _Snapshot.build(keys, terms, row_offsets.astype(np.int64), row_terms, row_weights)
+
+    def _write_snapshot(self):
+        snapshot = self._merged()
+        snapshot.save(self.snapshot_file)
+        # Everything logged so far is in the snapshot; replaying it again would change nothing.
+        self._log.close()
+        self._log = open(self.log_file, "w", encoding='utf-8')
+        self._log_entries = 0
+        self._base = snapshot
+        self._live = np.ones(len(snapshot.keys), dtype=bool)
+        self._live_count = len(snapshot.keys)
+        self.postings = {}
+        self.forward = {}
+
+    def __len__(self):
+        return len(self.forward) + self._live_count
+
+    def __contains__(self, key):
+        if key in self.forward:
+            return True
+        row = self._base.rows.get(key)
+        return row is not None and bool(self._live[row])
+
+    def add(self, keys: List[str], weights: List[Dict[str, float]]) -> None:
+        with self._lock:
+            lines = []
+            for key, key_weights in zip(keys, weights):
+                self._set(key, key_weights)
+                lines.append(json.dumps({"k": key, "w": key_weights}) + "\n")
+            if lines:
+                self._append_log(lines)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            if key in self:
+                self._unset(key)
+                self._append_log([json.dumps({"k": key}) + "\n"])
+
+    def missing(self, keys: Iterable[str]) -> List[str]:
+        return [key for key in keys if key not in self]
+
+    def _weights(self, key: str) -> Dict[str, float]:
+        if key in self.forward:
+            return self.forward[key]
+        row = self._base.rows.get(key)
+        return self._base.weights(row) if row is not None and self._live[row] else {}
+
+    def score(self, query_weights: Dict[str, float], key: str) -> float:
+        with self._lock:
+            weights = self._weights(key)
+            return sum(weight * weights.get(term, 0.0) for term, weight in query_weights.items())
+
+    def search(self, query_weights: Dict[str, float], n: int) -> List[Tuple[str, float]]:
+        """The n best keys sharing at least one term with the query, best first."""
+        with self._lock:
+            scores: Dict[str, float] = {}
+            for term, query_weight in query_weights.items():
+                for key, weight in self.postings.get(term, {}).items():
+                    scores[key] = scores.get(key, 0.0) + query_weight * weight
+            base = self._base
+            totals = np.zeros(len(base.keys), dtype=np.float64)
+            shared = np.zeros(len(base.keys), dtype=bool)
+            for term, query_weight in query_weights.items():
+                term_id = base.term_ids.get(term)
+                if term_id is None:
+                    continue
+                entries = slice(base.term_offsets[term_id], base.term_offsets[term_id + 1])
+                rows = base.term_rows[entries]
+                totals[rows] += query_weight * base.term_weights[entries]
+                shared[rows] = True
+            rows = np.flatnonzero(shared & self._live)
+            if len(rows) > n:
+                rows = rows[np.argpartition(-totals[rows], n - 1)[:n]]
+            for row in rows.tolist():
+                scores[str(base.keys[row])] = float(totals[row])
+        return heapq.nlargest(n, scores.items(), key=lambda item: item[1])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import embedding
+
+TEST_DIM = 32
+
+
+@pytest.fixture(autouse=True)
+def hashing_provider():
+    """Every test embeds with the hashing provider, so no model is downloaded."""
+    previous = embedding._provider
+    embedding.set_provider(embedding.HashingEmbeddingProvider(TEST_DIM))
+    yield embedding.get_provider()
+    embedding.set_provider(previous)
@@ -0,0 +1,48 @@
+import json
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def test_documents_round_trip_and_reopen(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model")
+    cache.put_documents(["one", "two"], np.eye(2, 4, dtype=np.float32), [None, {"t": 1.0}])
+    cache.put_document("one", np.zeros(4), {"u": 2.0})
+    np.testing.assert_array_equal(cache.get_document("one  "), np.eye(2, 4)[0])
+    assert cache.get_lexical("one") == {"u": 2.0}
+    cache.close()
+
+    cache = EmbeddingCache(str(tmp_path), "model")
+    assert cache.get_lexical("two") == {"t": 1.0}
+    assert cache.get_document("three") is None
+    assert cache.stats()["document_entries"] == 2
+    cache.close()
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", max_disk_bytes=3 * 16)
+    for text in ("a", "b", "c"):
+        cache.put_document(text, np.ones(4))
+    assert cache.get_document("a") is not None
+    cache.put_document("d", np.ones(4))
+    assert cache.get_document("b") is None
+    assert all(cache.get_document(text) is not None for text in ("a", "c", "d"))
+    assert cache.stats()["document_bytes"] <= 3 * 16
+    cache.close()
+
+
+def test_imports_files_of_the_old_layout(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model")
+    key = cache.key("legacy text")
+    cache.close()
+    np.save(os.path.join(cache.cache_dir, key + ".npy"), np.arange(4, dtype=np.float32))
+    with open(os.path.join(cache.cache_dir, key + ".lex.json"), "w", encoding='utf-8') as f:
+        json.dump({"legacy": 1.0}, f)
+
+    cache = EmbeddingCache(str(tmp_path), "model")
+    np.testing.assert_array_equal(cache.get_document("legacy text"), np.arange(4))
+    assert cache.get_lexical("legacy text") == {"legacy": 1.0}
+    assert not any(name.endswith((".npy", ".lex.json")) for name in os.listdir(cache.cache_dir))
+    cache.close()
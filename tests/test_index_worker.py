@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from document import Document
+from index_worker import IndexingWorker
+
+
+class RecordingStore:
+    """Records the writes the worker applies; `hold()` keeps the worker inside its current batch."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail_ids = set()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def hold(self):
+        self.entered.clear()
+        self.release.clear()
+
+    def _apply(self, call):
+        self.entered.set()
+        self.release.wait(5)
+        self.calls.append(call)
+        if any(doc_id in self.fail_ids for doc_id in call[1]):
+            raise RuntimeError("write failed")
+
+    def add_docs(self, docs, seal_segment=True):
+        self._apply(("add", [doc.id for doc in docs], [(doc.content, doc.source, doc.tags) for doc in docs]))
+
+    def delete_doc(self, doc):
+        self._apply(("delete", [doc.id], None))
+
+    def sync(self):
+        pass
+
+
+@pytest.fixture
+def worker_and_store():
+    store = RecordingStore()
+    worker = IndexingWorker(store, batch_delay=0.01)
+    yield worker, store
+    store.release.set()
+    worker.close(timeout=5)
+
+
+def block_worker(worker, store):
+    """Submits a write and waits until the worker is applying it, so later submits queue up."""
+    store.hold()
+    ticket = worker.submit_update(Document("blocker", "held"))
+    assert store.entered.wait(5)
+    return ticket
+
+
+def test_repeated_saves_coalesce_with_metadata(worker_and_store):
+    worker, store = worker_and_store
+    block_worker(worker, store)
+    first = worker.submit_update(Document("a", "one", source="clipboard", tags=["x"]))
+    doc = Document("a", "two")
+    second = worker.submit_update(doc)
+    doc.content = "edited after submit"
+    assert worker.pending() == 1
+    store.release.set()
+
+    assert worker.flush(timeout=5)
+    assert worker.status(first) is True and worker.status(second) is True
+    assert store.calls[-1] == ("add", ["a"], [("two", "clipboard", ["x"])])
+
+
+def test_put_then_delete_only_deletes(worker_and_store):
+    worker, store = worker_and_store
+    block_worker(worker, store)
+    worker.submit_update(Document("a", "text"))
+    ticket = worker.submit_delete(Document("a", ""))
+    store.release.set()
+
+    assert worker.flush(ticket, timeout=5)
+    assert store.calls[1:] == [("delete", ["a"], None)]
+
+
+def test_status_reports_pending_then_outcome(worker_and_store):
+    worker, store = worker_and_store
+    store.fail_ids.add("bad")
+    blocker = block_worker(worker, store)
+    good = worker.submit_update(Document("good", "text"))
+    bad = worker.submit_delete(Document("bad", ""))
+    assert worker.status(blocker) is None
+    assert worker.status(good) is None and worker.status(bad) is None
+    store.release.set()
+
+    worker.flush(timeout=5)
+    assert worker.status(blocker) is True
+    assert worker.status(good) is True
+    assert worker.status(bad) is False
+
+
+def test_flush_reports_failed_writes(worker_and_store):
+    worker, store = worker_and_store
+    store.fail_ids.add("bad")
+    bad = worker.submit_update(Document("bad", "text"))
+    assert worker.flush(bad, timeout=5) is False
+    assert worker.flush(timeout=5) is False
+    # Reported once by a full flush; later writes that succeed flush cleanly.
+    ok = worker.submit_update(Document("ok", "text"))
+    assert worker.flush(timeout=5) is True
+    assert worker.flush(ok, timeout=5) is True
+    assert worker.flush(bad, timeout=5) is False
@@ -0,0 +1,58 @@
+import prefix_index
+from document import Document
+from prefix_index import PrefixIndex
+
+
+def test_whole_words_rank_above_prefixes():
+    index = PrefixIndex()
+    index.build([Document("a", "planning the garden"), Document("b", "the plan for monday")])
+    assert [doc_id for doc_id, _ in index.search("plan", 2)] == ["b", "a"]
+    assert index.search("plan monday", 1) == [("b", 1.0)]
+
+
+def test_single_letters_are_ignored():
+    index = PrefixIndex()
+    index.build([Document("a", "a tiny note")])
+    assert index.search("a", 5) == []
+    assert index.search("t", 5) == []
+    assert [doc_id for doc_id, _ in index.search("a ti", 5)] == ["a"]
+
+
+def test_ties_go_to_the_newest_note():
+    index = PrefixIndex()
+    index.build([Document(str(i), "shared words here") for i in range(5)])
+    updated = {"0": 5.0, "1": 1.0, "2": 4.0, "3": 2.0, "4": 3.0}
+    ranked = index.search("shared", 3, recency=lambda doc_ids: [updated[doc_id] for doc_id in doc_ids])
+    assert [doc_id for doc_id, _ in ranked] == ["0", "2", "4"]
+
+
+def test_candidates_are_capped_to_the_latest_writes(monkeypatch):
+    monkeypatch.setattr(prefix_index, "MAX_CANDIDATES", 10)
+    index = PrefixIndex()
+    index.build([Document(str(i), "common word") for i in range(100)])
+    index.add("5", "common word again")
+    order = {str(i): i for i in range(100)}
+    order["5"] = 100
+    ranked = index.search("common", 3, recency=lambda doc_ids: [order[doc_id] for doc_id in doc_ids])
+    assert [doc_id for doc_id, _ in ranked] == ["5", "99", "98"]
+
+
+def test_writes_during_a_build_are_kept():
+    index = PrefixIndex()
+
+    def stored_notes():
+        yield Document("a", "old alpha text")
+        # The store keeps writing while the build reads the stored notes.
+        index.add("a", "new beta text")
+        index.add("c", "gamma text")
+        index.remove("b")
+        yield Document("b", "deleted delta text")
+
+    assert not index.ready
+    index.build(stored_notes())
+    assert index.ready
+    assert index.search("alpha", 5) == []
+    assert [doc_id for doc_id, _ in index.search("beta", 5)] == ["a"]
+    assert [doc_id for doc_id, _ in index.search("gamma", 5)] == ["c"]
+    assert index.search("delta", 5) == []
+    assert len(index) == 2
@@ -0,0 +1,80 @@
+import pytest
+
+from document import Document
+from vect_db import VectorStore
+
+NOTES = [
+    Document("n1", "the cat sat on the warm window sill", source="clipboard", tags=["home"]),
+    Document("n2", "a cat chased the mouse across the kitchen", source="editor", tags=["home"]),
+    Document("n3", "quarterly budget review with the finance team", source="editor", tags=["work"]),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VectorStore(str(tmp_path / "vect_db"))
+    store.add_docs([Document(doc.id, doc.content, doc.source, list(doc.tags)) for doc in NOTES])
+    yield store
+    store.close()
+
+
+def test_hits_are_copies(store):
+    first = store.search("cat", k=2)
+    first[0].doc.content = "edited by the caller"
+
+    second = store.search("cat", k=2)
+    assert store.result_cache.stats()["hits"] == 1
+    second[0].doc.content = "edited again"
+    third = store.search("cat", k=2)
+    assert [hit.doc.id for hit in third] == [hit.doc.id for hit in first]
+    assert all(hit.doc.content != "edited by the caller" and hit.doc.content != "edited again" for hit in third)
+
+
+@pytest.mark.parametrize("write", [
+    lambda store: store.add_doc(Document("n4", "the cat slept all afternoon")),
+    lambda store: store.update_doc(Document("n2", "a dog chased the mouse across the kitchen")),
+    lambda store: store.delete_doc(Document("n1", "")),
+    lambda store: store.touch_doc("n1"),
+], ids=["add_doc", "update_doc", "delete_doc", "touch_doc"])
+def test_writes_invalidate(store, write):
+    before = store.search("", k=3)
+    write(store)
+    after = store.search("", k=3)
+    assert store.result_cache.stats()["hits"] == 0
+    assert store.result_cache.stats()["stale"] == 1
+    assert [hit.doc.id for hit in after] == [doc.id for doc in store.recent_docs(3)]
+    assert [hit.doc.id for hit in after] != [hit.doc.id for hit in before]
+
+
+def test_search_overlapping_a_write_is_not_served(store, monkeypatch):
+    get_many = store.docs.get_many
+
+    def write_then_read(doc_ids):
+        # A write that completes after the search was stamped but before it is cached.
+        monkeypatch.setattr(store.docs, "get_many", get_many)
+        store.add_doc(Document("n4", "the cat slept all afternoon"))
+        return get_many(doc_ids)
+
+    monkeypatch.setattr(store.docs, "get_many", write_then_read)
+    overlapped = store.search("cat", k=3, mode="sparse")
+    assert "n4" not in [hit.doc.id for hit in overlapped]
+
+    fresh = store.search("cat", k=3, mode="sparse")
+    assert store.result_cache.stats()["hits"] == 0
+    assert "n4" in [hit.doc.id for hit in fresh]
+    # Stamped after the write, so this one is served.
+    store.search("cat", k=3, mode="sparse")
+    assert store.result_cache.stats()["hits"] == 1
+
+
+def test_filters_are_part_of_the_key(store):
+    unfiltered = store.search("cat", k=3)
+    clipboard = store.search("cat", k=3, filters={"source": "clipboard"})
+    work = store.search("cat", k=3, filters={"tags": ["work"]})
+    assert store.result_cache.stats()["hits"] == 0
+    assert {hit.doc.id for hit in unfiltered} >= {"n1", "n2"}
+    assert [hit.doc.id for hit in clipboard] == ["n1"]
+    assert all(hit.doc.id == "n3" for hit in work)
+
+    store.search("cat", k=3, filters={"source": "clipboard"})
+    assert store.result_cache.stats()["hits"] == 1
@@ -0,0 +1,121 @@
+import os
+import threading
+
+import numpy as np
+
+from segment_store import SegmentStore, normalize_rows
+
+DIM = 8
+
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def open_store(path, **kwargs):
+    kwargs.setdefault("auto_compact", False)
+    return SegmentStore(str(path), DIM, **kwargs)
+
+
+def wal_files(path):
+    return sorted(name for name in os.listdir(path) if name.startswith("wal-"))
+
+
+def test_replay_drops_torn_record(tmp_path):
+    store = open_store(tmp_path)
+    vectors = random_vectors(3)
+    store.put("a", vectors[0])
+    store.put("b", vectors[1])
+    store.close()
+    # A crash in the middle of the last record leaves only part of it on disk.
+    wal_path = os.path.join(tmp_path, wal_files(tmp_path)[-1])
+    with open(wal_path, "r+b") as f:
+        f.truncate(os.path.getsize(wal_path) - 5)
+
+    store = open_store(tmp_path)
+    assert "a" in store
+    assert "b" not in store
+    store.put("c", vectors[2])
+    store.close()
+
+    # The torn bytes were cut off, so the record written after them replays too.
+    store = open_store(tmp_path)
+    assert sorted(store.index) == ["a", "c"]
+    np.testing.assert_allclose(store.gather([store.index["c"]])[0], normalize_rows(vectors[2:3])[0], atol=1e-2)
+    store.close()
+
+
+def test_delete_seal_reopen(tmp_path):
+    store = open_store(tmp_path, segment_rows=4)
+    vectors = random_vectors(10)
+    store.put_many([f"d{i}" for i in range(10)], vectors)
+    store.flush()
+    assert store._mem_count == 0
+    assert all(len(segment) <= 4 for segment in store.segments)
+
+    store.delete("d1")
+    store.put("tail", vectors[0])
+    store.delete("tail")
+    store.flush()
+    store.delete("d7")
+    store.close()
+
+    store = open_store(tmp_path, segment_rows=4)
+    assert sorted(store.index) == sorted(f"d{i}" for i in range(10) if i not in (1, 7))
+    assert store.live_mask().sum() == len(store)
+    for i in (0, 5, 9):
+        np.testing.assert_allclose(store.gather([store.index[f"d{i}"]])[0],
+                                   normalize_rows(vectors[i:i + 1])[0], atol=1e-2)
+    store.close()
+
+
+def test_compaction_racing_with_writes(tmp_path):
+    store = open_store(tmp_path, segment_rows=16)
+    vectors = random_vectors(400)
+    expected = {}
+    for start in range(0, 200, 20):
+        ids = [f"d{i}" for i in range(start, start + 20)]
+        store.put_many(ids, vectors[start:start + 20])
+        expected.update(zip(ids, vectors[start:start + 20]))
+    for i in range(0, 200, 3):
+        store.delete(f"d{i}")
+        del expected[f"d{i}"]
+    store.flush()
+
+    def write(i):
+        store.put(f"d{i}", vectors[i % len(vectors)])
+        expected[f"d{i}"] = vectors[i % len(vectors)]
+        if i % 5 == 0:
+            # Rewrite a row that is being merged, and delete another.
+            store.put(f"d{i - 199}", vectors[i % len(vectors)])
+            expected[f"d{i - 199}"] = vectors[i % len(vectors)]
+            store.delete(f"d{i - 198}")
+            expected.pop(f"d{i - 198}", None)
+
+    i = 200
+    for _ in range(3):
+        compaction = threading.Thread(target=store.compact)
+        compaction.start()
+        # Keep writing, and sealing new segments, for as long as the merge runs.
+        written = 0
+        while compaction.is_alive() or written < 50:
+            write(i)
+            i += 1
+            written += 1
+        compaction.join()
+
+    def check(store):
+        assert sorted(store.index) == sorted(expected)
+        assert store.live_mask().sum() == len(expected)
+        ids = sorted(expected)
+        gathered = store.gather([store.index[doc_id] for doc_id in ids])
+        np.testing.assert_allclose(gathered, normalize_rows(np.stack([expected[doc_id] for doc_id in ids])),
+                                   atol=1e-2)
+
+    check(store)
+    store.close()
+    store = open_store(tmp_path, segment_rows=16)
+    check(store)
+    store.compact()
+    check(store)
+    store.close()
@@ -0,0 +1,27 @@
+import os
+
+import sparse_index
+from sparse_index import SPARSE_LOG_NAME, SPARSE_SNAPSHOT_NAME, SparseIndex
+
+
+def test_snapshot_and_log_survive_reopen(tmp_path, monkeypatch):
+    monkeypatch.setattr(sparse_index, "SNAPSHOT_LOG_ENTRIES", 10)
+    index = SparseIndex(str(tmp_path))
+    index.add([f"k{i}" for i in range(30)], [{"common": 1.0, f"t{i}": 2.0} for i in range(30)])
+    assert os.path.exists(tmp_path / SPARSE_SNAPSHOT_NAME)
+    # Written after the snapshot, so they only exist in the log.
+    index.add(["k1"], [{"rewritten": 1.0}])
+    index.remove("k2")
+    index.add(["new"], [{"common": 3.0}])
+    index.close()
+    assert os.path.getsize(tmp_path / SPARSE_LOG_NAME) > 0
+
+    index = SparseIndex(str(tmp_path))
+    assert len(index) == 30
+    assert "k2" not in index and "k1" in index
+    assert index.missing(["k1", "k2", "new"]) == ["k2"]
+    assert index.search({"common": 1.0}, 1) == [("new", 3.0)]
+    assert index.search({"t1": 1.0}, 5) == []
+    assert index.search({"rewritten": 1.0, "t5": 1.0}, 5) == [("k5", 2.0), ("k1", 1.0)]
+    assert index.score({"t7": 0.5, "common": 1.0}, "k7") == 2.0
+    index.close()
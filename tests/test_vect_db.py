@@ -0,0 +1,45 @@
+import json
+import os
+
+import numpy as np
+
+from embedding import get_embeddings
+from segment_store import MANIFEST_NAME
+from vect_db import VectorStore
+
+NOTES = {
+    "n1": "the cat sat on the warm window sill",
+    "n2": "quarterly budget review with the finance team",
+    "n3": "recipe for sourdough bread with a long cold proof",
+}
+
+
+def write_legacy_store(db_dir):
+    """The layout from before segment storage: one embeddings matrix, its id index and a text file per note."""
+    os.makedirs(os.path.join(db_dir, "docs"))
+    for doc_id, content in NOTES.items():
+        with open(os.path.join(db_dir, "docs", f"{doc_id}.txt"), "w", encoding='utf-8') as f:
+            f.write(content)
+    ids = list(NOTES)
+    np.save(os.path.join(db_dir, "embeddings.npy"), np.asarray(get_embeddings([NOTES[i] for i in ids])))
+    with open(os.path.join(db_dir, "embeddings_index.json"), "w", encoding='utf-8') as f:
+        json.dump({doc_id: row for row, doc_id in enumerate(ids)}, f)
+
+
+def test_migrates_legacy_embeddings(tmp_path):
+    db_dir = str(tmp_path / "vect_db")
+    write_legacy_store(db_dir)
+
+    store = VectorStore(db_dir)
+    assert os.path.exists(os.path.join(db_dir, MANIFEST_NAME))
+    assert os.path.isdir(os.path.join(db_dir, "docs.migrated"))
+    assert sorted(store.index) == sorted(NOTES)
+    assert store.find_docs("sourdough bread recipe", k=1)[0].id == "n3"
+    store.close()
+
+    # Reopening finds the manifest and does not migrate again.
+    store = VectorStore(db_dir)
+    assert sorted(store.index) == sorted(NOTES)
+    assert store.find_docs("budget review finance", k=1)[0].id == "n2"
+    assert store.docs.get("n1").content == NOTES["n1"]
+    store.close()
@@ -1,211 +1,1095 @@
-from document import Document
-from typing import List
+from document import Document, doc_from_file
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 import numpy as np
+import functools
 import json
 import os
-from embedding import get_embedding
+import threading
+import time
+import uuid
+from embedding import get_embedding, get_embeddings, get_hybrid_embeddings, get_provider
+from embedding_cache import EmbeddingCache, normalize_text
+from segment_store import MANIFEST_NAME, ReadOnlyStoreError, SegmentStore, normalize_rows
+from file_lock import FileLock
+from ivf_index import IVFIndex
+from doc_store import DocStore
+from sparse_index import SparseIndex
+from prefix_index import PrefixIndex, tokenize
+from dedup_index import DuplicateIndex, fingerprints
+from metadata_index import MetadataIndex
+from result_cache import DEFAULT_MAX_ENTRIES as DEFAULT_RESULT_CACHE_SIZE, ResultCache
+from metrics import incr, span, timed
+import metrics
+from chunking import parse_passage_key, passage_key, split_passages
 import logging
 
 DB_DIR = 'vect_db'
 DOC_FOLDER = os.path.join(DB_DIR, "docs")
 EMB_FILE = os.path.join(DB_DIR, "embeddings.npy")
 INDEX_FILE = os.path.join(DB_DIR, "embeddings_index.json")
+# Rows upcast to float32 at a time while scoring, so float16 segments are never copied whole.
+SCORE_CHUNK_ROWS = 8192
+# Upper bound on the (rows x queries) score matrix of one find_docs_many group.
+BATCH_SCORE_BYTES = 64 * 1024 * 1024
+# Rows per shard of a scan; shards are scored on a thread pool (NumPy releases the GIL) and merged.
+DEFAULT_SHARD_ROWS = 16384
+# Scoring threads; defaults to one per CPU core.
+SCORE_WORKERS_ENV = "RAG_NOTES_SCORE_WORKERS"
+DEFAULT_BATCH_SIZE = 32
+# Vectors used to train the ANN centroids, per centroid.
+ANN_TRAIN_SAMPLES_PER_LIST = 64
+QUANT_TRAIN_SAMPLES = 20000
+# Shortlist size as a multiple of k before exact rescoring; binary codes are coarser and need more.
+DEFAULT_RESCORE = {"int8": 4, "binary": 32}
 
-os.makedirs(DOC_FOLDER, exist_ok=True)
-
-def _load_index():
-    if not os.path.exists(INDEX_FILE):
-        return {}
-    try:
-        with open(INDEX_FILE, "r", encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        logging.warning(f"Failed to decode JSON from {INDEX_FILE}. Returning empty index.")
-        return {}
-
-def _save_index(index):
-    with open(INDEX_FILE, "w", encoding='utf-8') as f:
-        json.dump(index, f)
-
-def _load_embeddings():
-    if not os.path.exists(EMB_FILE):
-        return np.zeros((0, 1024), dtype=np.float32) 
-    try:
-        return np.load(EMB_FILE)
-    except ValueError: 
-        logging.warning(f"Failed to load embeddings from {EMB_FILE}. File might be corrupted. Re-initializing.")
-        if os.path.exists(EMB_FILE):
-            try:
-                os.remove(EMB_FILE)
-            except OSError as e:
-                logging.error(f"Could not remove corrupted embeddings file {EMB_FILE}: {e}")
-        if os.path.exists(INDEX_FILE):
-            try:
-                os.remove(INDEX_FILE)
-                logging.info(f"Removed index file {INDEX_FILE} due to embedding corruption.")
-            except OSError as e:
-                logging.error(f"Could not remove index file {INDEX_FILE}: {e}")
-        return np.zeros((0, 1024), dtype=np.float32)
+# Passages scored per requested document before widening the search.
+PASSAGE_OVERSAMPLE = 4
+AGGREGATIONS = ("max", "mean")
+DEFAULT_PASSAGE_TOP_N = 3
+SEARCH_MODES = ("dense", "sparse", "hybrid")
+FUSIONS = ("weighted", "rrf")
+# Weight of the lexical score in weighted fusion: dense + SPARSE_WEIGHT * sparse.
+DEFAULT_SPARSE_WEIGHT = 0.3
+# Rank offset of reciprocal-rank fusion.
+RRF_K = 60
 
-def _save_embeddings(arr):
-    np.save(EMB_FILE, arr)
+WRITE_LOCK_NAME = "write.lock"
+ProgressCallback = Callable[[int, int, float], None]
 
-def add_doc(doc: Document) -> None:
-    doc_path = os.path.join(DOC_FOLDER, doc.id + '.txt')
-    doc.to_file(doc_path)
-    embedding = np.array(get_embedding(doc.content))
-    embedding = embedding.reshape(1, -1)
-    index = _load_index()
-    embeddings = _load_embeddings()
-    if doc.id in index:
-        idx = index[doc.id]
-        if idx < len(embeddings):
-            embeddings[idx] = embedding
-        else: 
-            logging.warning(f"Index for doc ID {doc.id} was out of bounds. Re-adding.")
-            index.pop(doc.id) 
-            idx = embeddings.shape[0] 
-            index[doc.id] = idx
-            if embeddings.shape[0] == 0 and embedding.shape[0] > 0 :
-                 embeddings = embedding
-            elif embedding.shape[0] > 0 :
-                 embeddings = np.vstack([embeddings, embedding])
+
+class SearchHit:
+    """A ranked document, its aggregated score and the (start, end) span of its best passage."""
+
+    def __init__(self, doc: Document, score: float, span: Tuple[int, int]):
+        self.doc = doc
+        self.score = score
+        self.span = span
+
+    @property
+    def passage(self) -> str:
+        return self.doc.content[self.span[0]:self.span[1]]
+
+
+def _dot_scores(block: np.ndarray, query_embedding: np.ndarray) -> np.ndarray:
+    # Stored rows are unit length, so the dot product is the cosine similarity.
+    if block.dtype == np.float32:
+        return block @ query_embedding
+    sims = np.empty(block.shape[0], dtype=np.float32)
+    for start in range(0, block.shape[0], SCORE_CHUNK_ROWS):
+        chunk = block[start:start + SCORE_CHUNK_ROWS]
+        sims[start:start + chunk.shape[0]] = chunk.astype(np.float32) @ query_embedding
+    return sims
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (equal scores by index), via partial selection."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
     else:
-        idx = embeddings.shape[0] 
-        index[doc.id] = idx
-        if embeddings.shape[0] == 0 and embedding.shape[0] > 0:
-             embeddings = embedding
-        elif embedding.shape[0] > 0 :
-             embeddings = np.vstack([embeddings, embedding])
-    _save_index(index)
-    if embeddings.shape[0] > 0:
-        _save_embeddings(embeddings)
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
 
-def delete_doc(doc_to_delete: Document) -> None:
-    doc_path = os.path.join(DOC_FOLDER, doc_to_delete.id + '.txt')
-    if os.path.exists(doc_path):
+
+def _shards(blocks, shard_rows: int):
+    """Splits (start row, block) pairs into (start row, rows) pieces of at most `shard_rows` rows."""
+    for start, block in blocks:
+        for offset in range(0, block.shape[0], shard_rows):
+            yield start + offset, block[offset:offset + shard_rows]
+
+
+def default_score_workers() -> int:
+    setting = os.environ.get(SCORE_WORKERS_ENV, "")
+    return max(1, int(setting)) if setting.strip() else (os.cpu_count() or 1)
+
+
+def _writer(method):
+    """
+    Runs a store method under the writer lock and bumps the store generation
+    once it is done, invalidating cached search results; writes to a
+    read-only store raise.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.read_only:
+            raise ReadOnlyStoreError(f"{self.db_dir} is open read-only.")
+        with self._write_lock:
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                # After the write: a search stamped with the old generation may have seen part of it.
+                self._generation += 1
+    return wrapper
+
+
+def _freeze(value):
+    """A hashable form of search parameters such as `filters`."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(item) for item in value))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _copy_doc(doc: Document) -> Document:
+    return Document(doc.id, doc.content, doc.source, None if doc.tags is None else list(doc.tags))
+
+
+def _apply_threshold(ranked, min_similarity_threshold: float):
+    selected = []
+    for i, (doc_id, score, passage_no) in enumerate(ranked):
+        # Always include the first result; the rest must meet the threshold.
+        # Since results are sorted by similarity, once one falls below it the rest will too.
+        if i > 0 and score < min_similarity_threshold:
+            break
+        selected.append((doc_id, score, passage_no))
+    return selected
+
+
+def _to_hits(selected, found: Dict[str, Document]) -> List[SearchHit]:
+    hits = []
+    for doc_id, score, passage_no in selected:
+        doc = found.get(doc_id)
+        if doc is None:
+            continue
+        spans = split_passages(doc.content)
+        hits.append(SearchHit(doc, score, spans[min(passage_no, len(spans) - 1)]))
+    return hits
+
+
+class VectorStore:
+    """
+    Keeps the embedding matrix and the doc id -> row index resident in memory.
+    Vectors are persisted by an append-only `SegmentStore`, so a single write
+    only costs as much as the note being written.
+
+    Each note is split into overlapping passages and every passage is its own
+    row, keyed `<doc id>#<passage no>`. Searches score passages and aggregate
+    them per note.
+
+    Writes are serialized by one writer lock; searches score a snapshot of the
+    vectors and never wait for a write to finish. Across processes, the first
+    one to open the store holds `write.lock` and the others open it
+    read-only: they see the notes as of opening, and writes raise
+    `ReadOnlyStoreError`. Pass `read_only=False` to fail instead of falling
+    back, or `read_only=True` to never take the lock.
+    """
+
+    def __init__(self, db_dir: str = DB_DIR, dtype=np.float16, mmap: bool = True,
+                 read_only: Optional[bool] = None, shard_rows: int = DEFAULT_SHARD_ROWS,
+                 score_workers: Optional[int] = None, result_cache_size: int = DEFAULT_RESULT_CACHE_SIZE):
+        self.db_dir = db_dir
+        # Bumped after every write; cached search results from an older generation are never served.
+        self._generation = 0
+        self.result_cache = ResultCache(result_cache_size)
+        self.shard_rows = shard_rows
+        # May be changed at any time; the pool is resized on the next scan.
+        self.score_workers = score_workers or default_score_workers()
+        self._score_pool: Optional[ThreadPoolExecutor] = None
+        self._score_pool_workers = 0
+        self._score_pool_lock = threading.Lock()
+        self.doc_folder = os.path.join(db_dir, "docs")
+        self.emb_file = os.path.join(db_dir, "embeddings.npy")
+        self.index_file = os.path.join(db_dir, "embeddings_index.json")
+        os.makedirs(db_dir, exist_ok=True)
+        self._write_lock = threading.RLock()
+        self._file_lock = FileLock(os.path.join(db_dir, WRITE_LOCK_NAME))
+        if read_only is not True and not self._file_lock.acquire():
+            if read_only is False:
+                raise ReadOnlyStoreError(f"Another process is writing {db_dir}.")
+            logging.warning(f"Another process is writing {db_dir}; opening it read-only.")
+            read_only = True
+        self.read_only = bool(read_only)
+        self.docs = DocStore(db_dir)
+        needs_migration = False
+        if not self.read_only:
+            self.docs.migrate_folder(self.doc_folder)
+            needs_migration = not os.path.exists(os.path.join(db_dir, MANIFEST_NAME)) and os.path.exists(self.emb_file)
+        provider = get_provider()
+        self.vectors = SegmentStore(db_dir, dim=provider.dim, dtype=dtype, mmap=mmap, read_only=self.read_only)
+        if self.vectors.dim != provider.dim:
+            logging.warning(f"{db_dir} holds {self.vectors.dim}-dimensional vectors but {provider.name} produces "
+                            f"{provider.dim}; rebuild the store after switching embedding models.")
+        self.embedding_cache = EmbeddingCache(os.path.join(db_dir, "embedding_cache"), provider.name)
+        if needs_migration:
+            self._migrate_legacy_files()
+        self._doc_passages: Dict[str, List[str]] = {}
+        for key in self.index:
+            self._doc_passages.setdefault(parse_passage_key(key)[0], []).append(key)
+        self.ann = IVFIndex(db_dir, read_only=self.read_only)
+        if self.ann.trained and not self.read_only:
+            self._sync_ann_index()
+        # Lexical weights come from the same forward pass as the dense vectors, when the model has them.
+        self.sparse_enabled = provider.supports_sparse
+        self.sparse = SparseIndex(db_dir, read_only=self.read_only)
+        if self.sparse_enabled and len(self.sparse) < len(self.index):
+            logging.info(f"{len(self.index) - len(self.sparse)} passages have no lexical weights yet; "
+                         f"run build_sparse_index() to add them.")
+        # Tokenizing every note takes seconds on a large store; suggestions start once it is done.
+        self.prefix = PrefixIndex()
+        self._prefix_thread = threading.Thread(target=self._build_prefix_index, daemon=True)
+        self._prefix_thread.start()
+        self.duplicates = DuplicateIndex()
+        self.duplicates.build(self.docs.iter_fingerprints())
+        self.metadata = MetadataIndex()
+        self.metadata.build(self.docs.iter_metadata())
+
+    def _build_prefix_index(self):
         try:
-            os.remove(doc_path)
-        except OSError as e:
-            logging.error(f"Error removing document file {doc_path}: {e}")
-    index = _load_index()
-    embeddings = _load_embeddings()
-    if doc_to_delete.id not in index:
-        return
-    idx_to_delete = index.pop(doc_to_delete.id)
-    if idx_to_delete < embeddings.shape[0]:
-        embeddings = np.delete(embeddings, idx_to_delete, axis=0)
-        new_index = {}
-        for k_val, v_val in index.items(): # Renamed k,v to avoid conflict
-            if v_val > idx_to_delete:
-                new_index[k_val] = v_val - 1
-            else:
-                new_index[k_val] = v_val
-        _save_index(new_index)
-    else: 
-        logging.warning(f"Index for deleted doc ID {doc_to_delete.id} was out of bounds of embeddings array. Saving modified index only.")
-        _save_index(index)
-    if embeddings.shape[0] > 0:
-        _save_embeddings(embeddings)
-    elif os.path.exists(EMB_FILE):
+            self.prefix.build(self.docs.iter_all())
+        except Exception as e:
+            logging.error(f"Building the suggestion index failed: {e}")
+
+    @property
+    def index(self):
+        return self.vectors.index
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def _migrate_legacy_files(self):
+        index = self._load_legacy_index()
+        embeddings = self._load_legacy_embeddings()
+        rows = sorted((row, doc_id) for doc_id, row in index.items() if row < embeddings.shape[0])
+        if not rows:
+            return
+        self.vectors.put_many([doc_id for _, doc_id in rows], embeddings[[row for row, _ in rows]])
+        self.vectors.flush()
+        logging.info(f"Migrated {len(rows)} embeddings from {self.emb_file} into segment storage.")
+
+    def _load_legacy_index(self):
+        if not os.path.exists(self.index_file):
+            return {}
         try:
-            os.remove(EMB_FILE)
-        except OSError as e:
-            logging.error(f"Error removing empty embeddings file {EMB_FILE}: {e}")
+            with open(self.index_file, "r", encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            logging.warning(f"Failed to decode JSON from {self.index_file}. Returning empty index.")
+            return {}
 
-def update_doc(doc: Document) -> None:
-    add_doc(doc)
-
-def find_docs(query: str, k: int = 5, min_similarity_threshold: float = 0.0) -> List[Document]:
-    index = _load_index()
-    embeddings = _load_embeddings()
-    
-    if not query.strip() and k > 0: 
-        all_doc_ids = list(index.keys())
-        docs_to_return = []
-        for doc_id in all_doc_ids[:k]: 
-            doc_path = os.path.join(DOC_FOLDER, doc_id + '.txt')
-            if os.path.exists(doc_path):
-                 try:
-                    with open(doc_path, "r", encoding='utf-8') as f:
-                        content = f.read()
-                    docs_to_return.append(Document(doc_id, content))
-                 except Exception as e:
-                    logging.error(f"Error reading document {doc_path} in find_docs (empty query): {e}")
-        return docs_to_return
-
-    if not index or embeddings.shape[0] == 0:
-        return []
-
-    try:
-        query_embedding = np.array(get_embedding(query)).reshape(-1)
-    except Exception as e:
-        logging.error(f"Error getting embedding for query '{query[:50]}...': {e}")
-        return []
-    
-    sorted_index_items = sorted(index.items(), key=lambda item: item[1])
-    
-    aligned_doc_ids_map = {emb_idx_val: doc_id for doc_id, emb_idx_val in sorted_index_items if emb_idx_val < embeddings.shape[0]}
-    valid_embedding_indices = sorted(aligned_doc_ids_map.keys())
-
-    if not valid_embedding_indices:
-        return []
-        
-    relevant_embeddings = embeddings[valid_embedding_indices, :]
-
-    if relevant_embeddings.shape[0] == 0: return []
-
-    embedding_norms = np.linalg.norm(relevant_embeddings, axis=1)
-    query_norm = np.linalg.norm(query_embedding)
-    
-    denominator = embedding_norms * query_norm
-    sims_for_relevant = np.zeros(relevant_embeddings.shape[0])
-
-    valid_mask = denominator > 1e-9 # Check for non-zero denominator
-    if np.any(valid_mask):
-      sims_for_relevant[valid_mask] = (relevant_embeddings[valid_mask] @ query_embedding) / denominator[valid_mask]
-    
-    # Get original indices in the full `embeddings` array, sorted by similarity
-    # argsort sorts in ascending, so use negative sims for descending
-    num_possible_results = relevant_embeddings.shape[0]
-    # These are indices within `relevant_embeddings`
-    sorted_indices_in_relevant = np.argsort(-sims_for_relevant) 
-
-    docs = []
-    
-    # Always include the first result if available and k >= 1
-    if k >= 1 and num_possible_results > 0:
-        top_relevant_idx = sorted_indices_in_relevant[0]
-        original_emb_idx = valid_embedding_indices[top_relevant_idx] # map back to original index
-        doc_id = aligned_doc_ids_map[original_emb_idx]
-        doc_path = os.path.join(DOC_FOLDER, doc_id + '.txt')
-        if os.path.exists(doc_path):
+    def _load_legacy_embeddings(self):
+        try:
+            return np.load(self.emb_file)
+        except ValueError:
+            logging.warning(f"Failed to load embeddings from {self.emb_file}. File might be corrupted. Skipping migration.")
+            return np.zeros((0, self.vectors.dim), dtype=np.float32)
+
+    def _sync_ann_index(self):
+        # Assign rows written while the index was not loaded, e.g. by an older version.
+        missing = self.ann.missing(self.index.keys())
+        if missing:
+            rows = [self.index[doc_id] for doc_id in missing]
+            self.ann.add(missing, self.vectors.gather(rows))
+
+    @_writer
+    def build_ann_index(self, nlist: Optional[int] = None, nprobe: Optional[int] = None) -> None:
+        """
+        Trains an IVF index over the live vectors so `find_docs` only scores
+        the buckets closest to the query. `nlist` defaults to 4 * sqrt(N).
+        """
+        with self.vectors.lock:
+            doc_ids = list(self.index.keys())
+            rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(doc_ids))
+        if not doc_ids:
+            return
+        if nlist is None:
+            nlist = int(4 * np.sqrt(len(doc_ids)))
+        nlist = max(1, min(nlist, len(doc_ids)))
+        sample_size = min(len(doc_ids), nlist * ANN_TRAIN_SAMPLES_PER_LIST)
+        sample_rows = np.random.default_rng(0).choice(rows, sample_size, replace=False)
+        self.ann.train(self.vectors.gather(np.sort(sample_rows)), nlist)
+        if nprobe is not None:
+            self.ann.nprobe = nprobe
+        for start in range(0, len(doc_ids), SCORE_CHUNK_ROWS):
+            self.ann.add(doc_ids[start:start + SCORE_CHUNK_ROWS], self.vectors.gather(rows[start:start + SCORE_CHUNK_ROWS]))
+        logging.info(f"Built ANN index with {nlist} lists over {len(doc_ids)} passages.")
+
+    @_writer
+    def drop_ann_index(self) -> None:
+        self.ann.drop()
+
+    @_writer
+    def build_quantized_index(self, kind: str = "int8") -> None:
+        """
+        Adds int8 or binary codes of every stored vector. Searches then scan
+        the codes and rescore only a shortlist against the full vectors.
+        """
+        with self.vectors.lock:
+            rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+        sample_size = min(len(rows), QUANT_TRAIN_SAMPLES)
+        sample_rows = np.sort(np.random.default_rng(0).choice(rows, sample_size, replace=False))
+        sample = self.vectors.gather(sample_rows) if sample_size else np.zeros((0, self.vectors.dim), dtype=np.float32)
+        self.vectors.set_quantization(kind, sample)
+        logging.info(f"Built {kind} codes for {len(rows)} passages.")
+
+    @_writer
+    def drop_quantized_index(self) -> None:
+        self.vectors.set_quantization(None)
+
+    @_writer
+    def build_sparse_index(self, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """
+        Computes lexical weights for stored passages that have none, e.g.
+        notes indexed before hybrid search existed. Returns how many passages
+        were added.
+        """
+        if not self.sparse_enabled:
+            logging.warning(f"{get_provider().name} does not produce lexical weights; nothing to index.")
+            return 0
+        with self.vectors.lock:
+            missing = set(self.sparse.missing(self.index.keys()))
+            doc_ids = [doc_id for doc_id, keys in self._doc_passages.items() if any(key in missing for key in keys)]
+        added = 0
+        for start in range(0, len(doc_ids), batch_size):
+            keys = []
+            texts = []
+            for doc in self.docs.get_many(doc_ids[start:start + batch_size]).values():
+                for i, (a, b) in enumerate(split_passages(doc.content)):
+                    if passage_key(doc.id, i) in missing:
+                        keys.append(passage_key(doc.id, i))
+                        texts.append(doc.content[a:b])
+            if texts:
+                _, lexical = get_hybrid_embeddings(texts, batch_size=batch_size)
+                self.sparse.add(keys, lexical)
+                added += len(keys)
+        return added
+
+    def _read_docs(self, doc_ids: List[str]) -> List[Document]:
+        """Fetches notes in one batch, keeping the order of `doc_ids`."""
+        found = self.docs.get_many(doc_ids)
+        return [found[doc_id] for doc_id in doc_ids if doc_id in found]
+
+    def _refresh_metadata(self, doc_ids: List[str]) -> None:
+        for row in self.docs.iter_metadata(doc_ids):
+            self.metadata.put(*row)
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        embedding = self.embedding_cache.get_query(query)
+        if embedding is None:
+            embedding = np.asarray(get_embedding(query), dtype=np.float32).reshape(-1)
+            self.embedding_cache.put_query(query, embedding)
+        return embedding
+
+    def _plan_passages(self, doc: Document, old: Optional[Document]):
+        """
+        Splits `doc` into passages and returns the (key, text) pairs that need
+        embedding plus the keys to drop. Passages whose text is unchanged from
+        the stored version keep their existing rows.
+        """
+        spans = split_passages(doc.content)
+        old_texts = {}
+        if old is not None:
+            old_texts = {passage_key(doc.id, i): old.content[a:b] for i, (a, b) in enumerate(split_passages(old.content))}
+        changed = []
+        keys = set()
+        for i, (a, b) in enumerate(spans):
+            key = passage_key(doc.id, i)
+            keys.add(key)
+            text = doc.content[a:b]
+            if old_texts.get(key) != text or key not in self.index:
+                changed.append((key, text))
+        stale = [key for key in self._doc_passages.get(doc.id, []) if key not in keys]
+        return changed, stale, [passage_key(doc.id, i) for i in range(len(spans))]
+
+    def _embed_query_hybrid(self, query: str):
+        embedding = self.embedding_cache.get_query(query)
+        weights = self.embedding_cache.get_query_lexical(query)
+        if embedding is None or weights is None:
+            embeddings, lexical = get_hybrid_embeddings([query])
+            embedding, weights = embeddings[0], lexical[0]
+            self.embedding_cache.put_query(query, embedding, weights)
+        return embedding, weights
+
+    @timed("add_doc")
+    def add_doc(self, doc: Document) -> None:
+        self.add_docs([doc], seal_segment=False)
+
+    @timed("delete_doc")
+    @_writer
+    def delete_doc(self, doc_to_delete: Document) -> None:
+        self.docs.delete(doc_to_delete.id)
+        self.metadata.remove(doc_to_delete.id)
+        self.prefix.remove(doc_to_delete.id)
+        self.duplicates.remove(doc_to_delete.id)
+        with self.vectors.lock:
+            keys = self._doc_passages.pop(doc_to_delete.id, [])
+        for key in keys:
+            self.vectors.delete(key)
+            self.ann.remove(key)
+            self.sparse.remove(key)
+
+    @timed("add_docs")
+    @_writer
+    def add_docs(self, docs: Iterable[Document], batch_size: int = DEFAULT_BATCH_SIZE,
+                 progress: Optional[ProgressCallback] = None, seal_segment: bool = True) -> dict:
+        """
+        Embeds many documents with batched model calls and persists them in a
+        single step. Passages are grouped by length so each batch pads as
+        little as possible, and passages whose text did not change are not
+        embedded again. `progress(done, total, passages_per_sec)` is called
+        after every batch. With `seal_segment=False` the vectors stay in the
+        append log instead of being sealed into a segment right away, which
+        suits frequent small batches. Returns the number of docs and embedded
+        passages, elapsed seconds and docs/sec.
+        """
+        docs = list(docs)
+        started = time.perf_counter()
+        with span("add_docs.plan", docs=len(docs)):
+            old_docs = self.docs.get_many([doc.id for doc in docs])
+            pending = []
+            stale = []
+            doc_keys = {}
+            for doc in docs:
+                changed, doc_stale, keys = self._plan_passages(doc, old_docs.get(doc.id))
+                pending.extend(changed)
+                stale.extend(doc_stale)
+                doc_keys[doc.id] = keys
+
+        with span("add_docs.embed") as embed_span:
+            total = len(pending)
+            embeddings = np.zeros((total, self.vectors.dim), dtype=np.float32)
+            lexical = [None] * total
+            misses = []
+            for i, (_, text) in enumerate(pending):
+                cached = self.embedding_cache.get_document(text)
+                if cached is not None and self.sparse_enabled:
+                    lexical[i] = self.embedding_cache.get_lexical(text)
+                if cached is None or (self.sparse_enabled and lexical[i] is None):
+                    misses.append(i)
+                else:
+                    embeddings[i] = cached
+            order = sorted(misses, key=lambda i: len(pending[i][1]))
+            for batch_start in range(0, len(order), batch_size):
+                batch = order[batch_start:batch_start + batch_size]
+                texts = [pending[i][1] for i in batch]
+                if self.sparse_enabled:
+                    embeddings[batch], batch_lexical = get_hybrid_embeddings(texts, batch_size=batch_size)
+                    for i, weights in zip(batch, batch_lexical):
+                        lexical[i] = weights
+                else:
+                    embeddings[batch] = get_embeddings(texts, batch_size=batch_size)
+                self.embedding_cache.put_documents(texts, embeddings[batch], [lexical[i] for i in batch])
+                done = total - len(order) + batch_start + len(batch)
+                passages_per_sec = done / max(time.perf_counter() - started, 1e-9)
+                logging.info(f"Embedded {done}/{total} passages ({passages_per_sec:.1f} passages/sec).")
+                if progress is not None:
+                    progress(done, total, passages_per_sec)
+            embed_span.set(passages=total, cache_misses=len(misses))
+            incr("add_docs.passages_embedded", len(misses))
+            incr("add_docs.passages_cached", total - len(misses))
+
+        with span("add_docs.write"):
+            prints = [fingerprints(doc.content) for doc in docs]
+            self.docs.put_many(docs, prints)
+            self._refresh_metadata([doc.id for doc in docs])
+            for doc, (digest, fingerprint) in zip(docs, prints):
+                self.prefix.add(doc.id, doc.content)
+                self.duplicates.put(doc.id, digest, fingerprint)
+            keys = [key for key, _ in pending]
+            if keys:
+                # Unchanged text, e.g. saving a note again, embeds nothing.
+                self.vectors.put_many(keys, embeddings)
+            for key in stale:
+                self.vectors.delete(key)
+                self.ann.remove(key)
+                self.sparse.remove(key)
+            if self.sparse_enabled:
+                self.sparse.add(keys, lexical)
+            with self.vectors.lock:
+                self._doc_passages.update(doc_keys)
+            if seal_segment:
+                self.vectors.flush()
+            self.ann.add(keys, normalize_rows(embeddings))
+
+        elapsed = time.perf_counter() - started
+        return {"docs": len(docs), "passages": total, "seconds": elapsed,
+                "docs_per_sec": len(docs) / max(elapsed, 1e-9)}
+
+    def import_folder(self, path: str, extensions=(".txt", ".md"), batch_size: int = DEFAULT_BATCH_SIZE,
+                      progress: Optional[ProgressCallback] = None) -> dict:
+        """Imports every note file under `path` as a new document."""
+        docs = []
+        for root, _, file_names in os.walk(path):
+            for file_name in sorted(file_names):
+                if not file_name.lower().endswith(tuple(extensions)):
+                    continue
+                try:
+                    doc = doc_from_file(os.path.join(root, file_name))
+                except (OSError, UnicodeDecodeError) as e:
+                    logging.error(f"Skipping {file_name} during import: {e}")
+                    continue
+                if doc.content.strip():
+                    docs.append(Document(str(uuid.uuid4()), doc.content, source="import"))
+        return self.add_docs(docs, batch_size=batch_size, progress=progress)
+
+    def find_duplicate(self, text: str) -> Optional[Tuple[Document, bool]]:
+        """
+        A stored note with the same or nearly the same content as `text`, and
+        whether it is an exact duplicate. Runs before any embedding, so
+        recaptured text costs no model call.
+        """
+        match = self.duplicates.find(text)
+        if match is None:
+            return None
+        doc = self.docs.get(match[0])
+        return None if doc is None else (doc, normalize_text(doc.content) == normalize_text(text))
+
+    @_writer
+    def touch_doc(self, doc_id: str) -> None:
+        self.docs.touch(doc_id)
+        self._refresh_metadata([doc_id])
+
+    @_writer
+    def tag_doc(self, doc_id: str, tags: List[str]) -> None:
+        """Replaces the tags of a note, without re-embedding or marking it updated."""
+        self.docs.set_tags(doc_id, tags)
+        self._refresh_metadata([doc_id])
+
+    def get_metadata(self, doc_id: str) -> Optional[dict]:
+        """created_at, updated_at, source and tags of a note, or None if it does not exist."""
+        return self.metadata.get(doc_id)
+
+    def recent_docs(self, n: int = 20, by: str = "updated", filters: Optional[dict] = None) -> List[Document]:
+        """The `n` most recently updated (or created) notes passing `filters`, newest first."""
+        return self._read_docs(self.metadata.recent(n, by, self.metadata.match(filters)))
+
+    @timed("update_doc")
+    def update_doc(self, doc: Document) -> None:
+        self.add_doc(doc)
+
+    @_writer
+    def compact(self) -> None:
+        self.vectors.compact()
+
+    def sync(self) -> None:
+        """Forces every write applied so far onto disk."""
+        self.vectors.sync()
+
+    def close(self) -> None:
+        self._prefix_thread.join()
+        with self._write_lock:
+            self.sparse.close()
+            self.ann.close()
+            self.vectors.close()
+            self.docs.close()
+            self.embedding_cache.close()
+            self._file_lock.release()
+        with self._score_pool_lock:
+            if self._score_pool is not None:
+                self._score_pool.shutdown(wait=False)
+                self._score_pool = None
+
+    def _map_shards(self, fn: Callable, shards: list) -> list:
+        """`[fn(shard) for shard in shards]`, on the scoring pool when there is more than one shard."""
+        workers = min(self.score_workers, len(shards))
+        if workers <= 1:
+            return [fn(shard) for shard in shards]
+        with self._score_pool_lock:
+            if self._score_pool is None or self._score_pool_workers != self.score_workers:
+                if self._score_pool is not None:
+                    self._score_pool.shutdown(wait=False)
+                self._score_pool = ThreadPoolExecutor(self.score_workers, thread_name_prefix="vect-db-score")
+                self._score_pool_workers = self.score_workers
+            pool = self._score_pool
+        return list(pool.map(fn, shards))
+
+    def _scan_top_k(self, blocks, score: Callable[[np.ndarray], np.ndarray], live: np.ndarray, k: int):
+        """
+        Rows and scores of the k best live rows under `score(block)`. Each
+        shard keeps its own top k, and the shard results are merged.
+        """
+        def scan(shard):
+            start, block = shard
+            scores = score(block)
+            scores[~live[start:start + block.shape[0]]] = -np.inf
+            top = _top_k(scores, k)
+            return top + start, scores[top]
+
+        shards = list(_shards(blocks, self.shard_rows))
+        with span("search.scan", shards=len(shards)):
+            parts = self._map_shards(scan, shards)
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows = np.concatenate([part_rows for part_rows, _ in parts])
+        scores = np.concatenate([part_scores for _, part_scores in parts])
+        # Parts come in row order, so equal scores keep the same order whatever the shard layout.
+        best = _top_k(scores, k)
+        return rows[best], scores[best]
+
+    def _snapshot(self, allowed: Optional[Set[str]] = None):
+        """A snapshot of the vectors, with the rows of notes outside `allowed` masked out as if deleted."""
+        with self.vectors.lock:
+            snapshot = self.vectors.snapshot()
+            if allowed is not None:
+                rows = [self.index[key] for doc_id in allowed for key in self._doc_passages.get(doc_id, ())
+                        if key in self.index]
+                mask = np.zeros(snapshot.row_count, dtype=bool)
+                mask[rows] = True
+                snapshot.live &= mask
+        return snapshot
+
+    def _rank_exact(self, query_embedding: np.ndarray, k: int, allowed: Optional[Set[str]] = None):
+        snapshot = self._snapshot(allowed)
+        k = min(k, int(np.count_nonzero(snapshot.live)))
+        rows, sims = self._scan_top_k(snapshot.blocks, lambda block: _dot_scores(block, query_embedding),
+                                      snapshot.live, k)
+        return [(snapshot.doc_id_at(row), sim) for row, sim in zip(rows, sims)]
+
+    def _rank_approximate(self, query_embedding: np.ndarray, k: int, nprobe: Optional[int],
+                          allowed: Optional[Set[str]] = None):
+        candidates = self.ann.candidates(query_embedding, nprobe)
+        if allowed is not None:
+            candidates = [key for key in candidates if parse_passage_key(key)[0] in allowed]
+        with self.vectors.lock:
+            keys = [key for key in candidates if key in self.index]
+            if len(keys) < min(k, len(self.vectors)):
+                # Too few passages in the probed buckets; fall back to the exact scan.
+                return None
+            rows = [self.index[key] for key in keys]
+            snapshot = self.vectors.snapshot()
+        sims = snapshot.gather(rows) @ query_embedding
+        return [(keys[i], sims[i]) for i in _top_k(sims, k)]
+
+    def _rank_quantized(self, snapshot, query_embedding: np.ndarray, k: int, rescore: Optional[int]):
+        quantizer = snapshot.quantizer
+        prepared = quantizer.prepare(query_embedding)
+        n_live = int(np.count_nonzero(snapshot.live))
+        shortlist, _ = self._scan_top_k(snapshot.code_blocks, lambda codes: quantizer.score(codes, prepared),
+                                        snapshot.live, min(n_live, k * (rescore or DEFAULT_RESCORE[quantizer.kind])))
+        shortlist = np.sort(shortlist)
+        sims = snapshot.gather(shortlist) @ query_embedding
+        return [(snapshot.doc_id_at(shortlist[i]), sims[i]) for i in _top_k(sims, min(k, n_live))]
+
+    def _rank_passages(self, query_embedding: np.ndarray, k: int, nprobe: Optional[int], exact: bool,
+                       rescore: Optional[int] = None, allowed: Optional[Set[str]] = None):
+        """
+        The k best passages by the fastest available method. With `allowed`,
+        only passages of those notes are ranked: the scans mask every other
+        row before scoring.
+        """
+        ranked = None
+        if self.ann.trained and not exact:
+            ranked = self._rank_approximate(query_embedding, k, nprobe, allowed)
+        if ranked is None and not exact and self.vectors.quantizer is not None:
+            snapshot = self._snapshot(allowed)
+            if snapshot.quantizer is not None:
+                ranked = self._rank_quantized(snapshot, query_embedding, k, rescore)
+        if ranked is None:
+            ranked = self._rank_exact(query_embedding, k, allowed)
+        return ranked
+
+    def _search_sparse(self, query_weights: Dict[str, float], n: int, allowed: Optional[Set[str]] = None):
+        if allowed is None:
+            return self.sparse.search(query_weights, n)
+        # Lexical postings are not row-aligned; widen the search until enough allowed passages come back.
+        limit = n
+        while True:
+            ranked = self.sparse.search(query_weights, limit)
+            kept = [(key, score) for key, score in ranked if parse_passage_key(key)[0] in allowed]
+            if len(kept) >= n or len(ranked) < limit:
+                return kept[:n]
+            limit *= PASSAGE_OVERSAMPLE
+
+    def _rank_hybrid(self, query_embedding: np.ndarray, query_weights: Dict[str, float], n: int,
+                     nprobe: Optional[int], exact: bool, fusion: str, sparse_weight: float,
+                     rescore: Optional[int] = None, allowed: Optional[Set[str]] = None):
+        """Fuses the dense and lexical passage rankings, by weighted score sum or reciprocal rank."""
+        dense = self._rank_passages(query_embedding, n, nprobe, exact, rescore, allowed)
+        sparse = self._search_sparse(query_weights, n, allowed)
+        if fusion == "rrf":
+            scores = {}
+            for ranking in (dense, sparse):
+                for rank, (key, _) in enumerate(ranking):
+                    scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+        else:
+            dense_scores = {key: float(score) for key, score in dense}
+            sparse_scores = dict(sparse)
+            with self.vectors.lock:
+                # Lexical-only candidates still get their exact dense score.
+                only_sparse = [key for key in sparse_scores if key not in dense_scores and key in self.index]
+                rows = [self.index[key] for key in only_sparse]
+                snapshot = self.vectors.snapshot()
+            if only_sparse:
+                sims = snapshot.gather(rows) @ query_embedding
+                dense_scores.update(zip(only_sparse, sims.tolist()))
+            scores = {}
+            for key, dense_score in dense_scores.items():
+                sparse_score = sparse_scores[key] if key in sparse_scores else self.sparse.score(query_weights, key)
+                scores[key] = dense_score + sparse_weight * sparse_score
+        with self.vectors.lock:
+            return sorted(((key, score) for key, score in scores.items() if key in self.index), key=lambda item: -item[1])
+
+    def _rank_docs(self, rank_passages: Callable[[int], list], k: int, aggregation: str, passage_top_n: int):
+        """
+        Ranks documents by the scores `rank_passages(n)` gives their passages:
+        the best passage (`max`) or the mean of the best `passage_top_n`
+        passages (`mean`). Returns (doc id, score, best passage number)
+        tuples, best first.
+        """
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation '{aggregation}', expected one of {AGGREGATIONS}.")
+        n_passages = k * PASSAGE_OVERSAMPLE
+        while True:
+            ranked = rank_passages(n_passages)
+            per_doc: Dict[str, list] = {}
+            for key, score in ranked:
+                doc_id, passage_no = parse_passage_key(key)
+                per_doc.setdefault(doc_id, []).append((float(score), passage_no))
+            if len(per_doc) >= k or n_passages >= len(self.vectors):
+                break
+            n_passages *= PASSAGE_OVERSAMPLE
+        results = []
+        for doc_id, scores in per_doc.items():
+            # Passages arrive best first.
+            if aggregation == "max":
+                score = scores[0][0]
+            else:
+                score = sum(s for s, _ in scores[:passage_top_n]) / len(scores[:passage_top_n])
+            results.append((doc_id, score, scores[0][1]))
+        results.sort(key=lambda result: -result[1])
+        return results[:k]
+
+    @timed("search")
+    def search(self, query: str, k: int = 5, min_similarity_threshold: float = 0.0,
+               nprobe: Optional[int] = None, exact: bool = False,
+               cancelled: Optional[Callable[[], bool]] = None,
+               aggregation: str = "max", passage_top_n: int = DEFAULT_PASSAGE_TOP_N,
+               mode: str = "dense", fusion: str = "weighted",
+               sparse_weight: float = DEFAULT_SPARSE_WEIGHT, rescore: Optional[int] = None,
+               filters: Optional[dict] = None) -> List[SearchHit]:
+        """
+        Returns up to k documents ranked by cosine similarity to the query,
+        with their score and best-matching passage. With an ANN index built,
+        only the `nprobe` closest buckets are scored (higher is slower but
+        closer to exact). With quantized codes, the codes of every passage are
+        scored and the best `rescore * k` are rescored exactly. `exact=True`
+        always scans every full vector. If
+        `cancelled()` turns true between stages the search stops early and
+        returns [].
+
+        `mode="sparse"` matches the query's terms against the lexical index
+        without calling the model; `mode="hybrid"` fuses dense and lexical
+        scores with `fusion` ("weighted": dense + sparse_weight * sparse, or
+        "rrf": reciprocal-rank fusion). The threshold applies to the fused
+        score.
+
+        `filters` restricts the search to notes by metadata, e.g.
+        `{"source": "clipboard", "tags": ["work"], "updated_after": ts}` (see
+        `MetadataIndex.match`); non-matching rows are masked before scoring.
+        An empty query returns the most recently updated notes.
+
+        Results are cached per normalized query and parameters until the next
+        write, and repeated searches return copies of the cached documents
+        without reading them again.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}.")
+        if fusion not in FUSIONS:
+            raise ValueError(f"Unknown fusion '{fusion}', expected one of {FUSIONS}.")
+        if mode != "dense" and not self.sparse_enabled:
+            logging.warning(f"{get_provider().name} has no lexical weights; using dense search.")
+            mode = "dense"
+        generation = self._generation
+        cache_key = (normalize_text(query), k, min_similarity_threshold, nprobe, exact, aggregation, passage_top_n,
+                     mode, fusion, sparse_weight, rescore, _freeze(filters))
+        cached = self.result_cache.get(cache_key, generation)
+        if cached is not None:
+            incr("search.result_cache_hits")
+            return [SearchHit(_copy_doc(doc), score, span) for doc, score, span in cached]
+
+        allowed = self.metadata.match(filters)
+        if not query.strip() and k > 0:
+            doc_ids = self.metadata.recent(k, allowed=allowed)
+            hits = [SearchHit(doc, 0.0, (0, len(doc.content))) for doc in self._read_docs(doc_ids)]
+            return self._cache_results(cache_key, generation, hits)
+
+        if len(self.vectors) == 0 or (allowed is not None and not allowed):
+            return []
+
+        if mode == "sparse":
+            query_weights = {term: 1.0 for term in get_provider().query_terms(query)}
+            rank_passages = lambda n: self._search_sparse(query_weights, n, allowed)
+        else:
+            try:
+                with span("search.embed_query"):
+                    if mode == "hybrid":
+                        query_embedding, query_weights = self._embed_query_hybrid(query)
+                    else:
+                        query_embedding = self._embed_query(query)
+            except Exception as e:
+                logging.error(f"Error getting embedding for query '{query[:50]}...': {e}")
+                return []
+            query_embedding = normalize_rows(query_embedding).reshape(-1)
+            if mode == "hybrid":
+                rank_passages = lambda n: self._rank_hybrid(query_embedding, query_weights, n, nprobe, exact, fusion,
+                                                            sparse_weight, rescore, allowed)
+            else:
+                rank_passages = lambda n: self._rank_passages(query_embedding, n, nprobe, exact, rescore, allowed)
+        if cancelled is not None and cancelled():
+            return []
+
+        with span("search.rank", mode=mode, k=k):
+            ranked = self._rank_docs(rank_passages, k, aggregation, passage_top_n)
+        if cancelled is not None and cancelled():
+            return []
+
+        selected = _apply_threshold(ranked, min_similarity_threshold)
+        with span("search.read_docs", docs=len(selected)):
+            found = self.docs.get_many([doc_id for doc_id, _, _ in selected])
+        return self._cache_results(cache_key, generation, _to_hits(selected, found))
+
+    def _cache_results(self, cache_key: tuple, generation: int, hits: List[SearchHit]) -> List[SearchHit]:
+        # Copies, since callers may edit the documents they get back.
+        self.result_cache.put(cache_key, generation, [(_copy_doc(hit.doc), hit.score, hit.span) for hit in hits])
+        return hits
+
+    @timed("find_docs_many")
+    def find_docs_many(self, queries: List[str], k: int = 5, min_similarity_threshold: float = 0.0,
+                       nprobe: Optional[int] = None, exact: bool = False,
+                       aggregation: str = "max", passage_top_n: int = DEFAULT_PASSAGE_TOP_N,
+                       rescore: Optional[int] = None, unique: bool = False,
+                       filters: Optional[dict] = None) -> List[List[SearchHit]]:
+        """
+        Runs several dense queries at once and returns a hit list per query,
+        in query order. Uncached query embeddings are computed in one model
+        batch, the exact scan scores all queries in one matrix-matrix product
+        per block, and the notes returned are read in one fetch. With
+        `unique=True`, a note already returned for an earlier query is left
+        out of the later ones, e.g. when the results share one LLM context.
+        `filters` applies to every query, as in `search`.
+
+        With an ANN index or quantized codes (and not `exact`), candidates
+        differ per query, so each query is ranked on its own.
+        """
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation '{aggregation}', expected one of {AGGREGATIONS}.")
+        queries = list(queries)
+        allowed = self.metadata.match(filters)
+        results: List[List[SearchHit]] = [[] for _ in queries]
+        todo = []
+        for i, query in enumerate(queries):
+            if query.strip():
+                todo.append(i)
+            else:
+                results[i] = self.search(query, k, filters=filters)
+        if not todo or k <= 0 or len(self.vectors) == 0 or (allowed is not None and not allowed):
+            return results
+
+        with span("find_docs_many.embed", queries=len(todo)):
             try:
-                with open(doc_path, "r", encoding='utf-8') as f:
-                    content = f.read()
-                docs.append(Document(doc_id, content))
+                query_embeddings = self._embed_queries([queries[i] for i in todo])
             except Exception as e:
-                logging.error(f"Error reading document {doc_path} for top search result: {e}")
-
-    # Add other results if they meet the threshold and k > 1
-    if k > 1 and num_possible_results > 1:
-        # Start from the second potential result
-        for i in range(1, min(k, num_possible_results)): 
-            relevant_idx = sorted_indices_in_relevant[i]
-            current_score = sims_for_relevant[relevant_idx]
-
-            if current_score >= min_similarity_threshold:
-                original_emb_idx = valid_embedding_indices[relevant_idx]
-                doc_id = aligned_doc_ids_map[original_emb_idx]
-                doc_path = os.path.join(DOC_FOLDER, doc_id + '.txt')
-                if os.path.exists(doc_path):
-                    try:
-                        with open(doc_path, "r", encoding='utf-8') as f:
-                            content = f.read()
-                        docs.append(Document(doc_id, content))
-                    except Exception as e:
-                        logging.error(f"Error reading document {doc_path} for subsequent search result: {e}")
+                logging.error(f"Error getting embeddings for {len(todo)} queries: {e}")
+                return results
+
+        # With `unique`, a query may have to skip every note taken by the ones before it.
+        n_docs = k * len(todo) if unique else k
+        with span("find_docs_many.rank", queries=len(todo), k=k):
+            if exact or not (self.ann.trained or self.vectors.quantizer is not None):
+                ranked = self._rank_docs_exact_many(query_embeddings, n_docs, aggregation, passage_top_n, allowed)
             else:
-                # Since results are sorted by similarity, if one doesn't meet threshold, subsequent ones won't either
-                break 
-    return docs
\ No newline at end of file
+                ranked = [self._rank_docs(lambda n, q=q: self._rank_passages(q, n, nprobe, exact, rescore, allowed),
+                                          n_docs, aggregation, passage_top_n) for q in query_embeddings]
+
+        selected = []
+        taken = set()
+        for query_ranked in ranked:
+            if unique:
+                query_ranked = [item for item in query_ranked if item[0] not in taken]
+            query_selected = _apply_threshold(query_ranked[:k], min_similarity_threshold)
+            taken.update(doc_id for doc_id, _, _ in query_selected)
+            selected.append(query_selected)
+        doc_ids = list(dict.fromkeys(doc_id for query_selected in selected for doc_id, _, _ in query_selected))
+        with span("find_docs_many.read_docs", docs=len(doc_ids)):
+            found = self.docs.get_many(doc_ids)
+        for i, query_selected in zip(todo, selected):
+            results[i] = _to_hits(query_selected, found)
+        return results
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        embeddings = np.zeros((len(queries), self.vectors.dim), dtype=np.float32)
+        misses = []
+        for i, query in enumerate(queries):
+            cached = self.embedding_cache.get_query(query)
+            if cached is None:
+                misses.append(i)
+            else:
+                embeddings[i] = cached
+        if misses:
+            embeddings[misses] = get_embeddings([queries[i] for i in misses])
+            for i in misses:
+                self.embedding_cache.put_query(queries[i], embeddings[i])
+        return normalize_rows(embeddings)
+
+    def _rank_docs_exact_many(self, query_embeddings: np.ndarray, k: int, aggregation: str, passage_top_n: int,
+                              allowed: Optional[Set[str]] = None):
+        """`_rank_docs` over the exact scan for many queries, scoring each block once per group of queries."""
+        snapshot = self._snapshot(allowed)
+        n_live = int(np.count_nonzero(snapshot.live))
+        # Queries per group, so the (rows x queries) score matrix stays within BATCH_SCORE_BYTES.
+        group = max(1, BATCH_SCORE_BYTES // (4 * max(1, snapshot.row_count)))
+        ranked = []
+        for group_start in range(0, query_embeddings.shape[0], group):
+            queries_t = np.ascontiguousarray(query_embeddings[group_start:group_start + group].T)
+            sims = np.empty((snapshot.row_count, queries_t.shape[1]), dtype=np.float32)
+
+            def score(shard, sims=sims, queries_t=queries_t):
+                start, block = shard
+                for chunk_start in range(0, block.shape[0], SCORE_CHUNK_ROWS):
+                    chunk = block[chunk_start:chunk_start + SCORE_CHUNK_ROWS]
+                    rows = slice(start + chunk_start, start + chunk_start + chunk.shape[0])
+                    sims[rows] = chunk.astype(np.float32, copy=False) @ queries_t
+
+            self._map_shards(score, list(_shards(snapshot.blocks, self.shard_rows)))
+            sims[~snapshot.live] = -np.inf
+            for j in range(sims.shape[1]):
+                column = np.ascontiguousarray(sims[:, j])
+                rank_passages = lambda n, column=column: [(snapshot.doc_id_at(row), column[row])
+                                                          for row in _top_k(column, min(n, n_live))]
+                ranked.append(self._rank_docs(rank_passages, k, aggregation, passage_top_n))
+        return ranked
+
+    @timed("suggest")
+    def suggest(self, query: str, k: int = 5) -> List[SearchHit]:
+        """
+        Notes containing words that start with the query's words, from the
+        in-memory prefix index. No model call, so it can run on every
+        keystroke; the span is the passage holding the first matching word.
+        Equally good matches are ordered by last update, newest first. Empty
+        until the index has been built after opening the store.
+        """
+        if not self.prefix.ready:
+            return []
+        ranked = self.prefix.search(query, k, recency=self.metadata.timestamps)
+        found = self.docs.get_many([doc_id for doc_id, _ in ranked])
+        prefixes = tokenize(query)
+        hits = []
+        for doc_id, score in ranked:
+            doc = found.get(doc_id)
+            if doc is None:
+                continue
+            lowered = doc.content.lower()
+            positions = [lowered.find(prefix) for prefix in prefixes]
+            position = min((p for p in positions if p >= 0), default=0)
+            spans = split_passages(doc.content)
+            hits.append(SearchHit(doc, score, next((span for span in spans if span[1] > position), spans[-1])))
+        return hits
+
+    def find_docs(self, query: str, k: int = 5, min_similarity_threshold: float = 0.0,
+                  nprobe: Optional[int] = None, exact: bool = False,
+                  cancelled: Optional[Callable[[], bool]] = None, filters: Optional[dict] = None) -> List[Document]:
+        """Like `search`, returning only the documents."""
+        return [hit.doc for hit in self.search(query, k, min_similarity_threshold, nprobe, exact, cancelled,
+                                               filters=filters)]
+
+    def measure_recall(self, queries: Optional[List[str]] = None, k: int = 10, sample: int = 100,
+                       nprobe: Optional[int] = None, rescore: Optional[int] = None) -> dict:
+        """
+        Recall@k of the approximate passage ranking (ANN buckets or quantized
+        codes) against the exact scan, with the mean latency of each, to pick
+        `nprobe`/`rescore` for a deployment. Without `queries`, a sample of
+        stored passages is used as the queries.
+        """
+        if queries:
+            query_vectors = normalize_rows(get_embeddings(queries))
+        else:
+            with self.vectors.lock:
+                rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+            rows = np.random.default_rng(0).choice(rows, min(sample, len(rows)), replace=False)
+            query_vectors = self.vectors.gather(np.sort(rows))
+        exact_seconds = approx_seconds = 0.0
+        recalls = []
+        for query_embedding in query_vectors:
+            started = time.perf_counter()
+            expected = {key for key, _ in self._rank_exact(query_embedding, k)}
+            exact_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            found = {key for key, _ in self._rank_passages(query_embedding, k, nprobe, False, rescore)}
+            approx_seconds += time.perf_counter() - started
+            if expected:
+                recalls.append(len(found & expected) / len(expected))
+        n = max(len(query_vectors), 1)
+        method = "ivf" if self.ann.trained else (self.vectors.quantizer.kind if self.vectors.quantizer else "exact")
+        return {"method": method, "k": k, "queries": len(query_vectors),
+                "recall": float(np.mean(recalls)) if recalls else 1.0,
+                "exact_ms": exact_seconds * 1000.0 / n, "approx_ms": approx_seconds * 1000.0 / n}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> VectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VectorStore()
+    return _store
+
+def add_doc(doc: Document) -> None:
+    get_store().add_doc(doc)
+
+def delete_doc(doc_to_delete: Document) -> None:
+    get_store().delete_doc(doc_to_delete)
+
+def add_docs(docs: Iterable[Document], batch_size: int = DEFAULT_BATCH_SIZE,
+             progress: Optional[ProgressCallback] = None) -> dict:
+    return get_store().add_docs(docs, batch_size, progress)
+
+def import_folder(path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                  progress: Optional[ProgressCallback] = None) -> dict:
+    return get_store().import_folder(path, batch_size=batch_size, progress=progress)
+
+def update_doc(doc: Document) -> None:
+    get_store().update_doc(doc)
+
+def compact() -> None:
+    get_store().compact()
+
+def stats() -> dict:
+    """Timings and counters of the instrumented operations, plus the size of the store and its caches."""
+    store = get_store()
+    return {**metrics.stats(), "notes": len(store.docs), "passages": len(store.vectors),
+            "segments": len(store.vectors.segments), "embedding_cache": store.embedding_cache.stats(),
+            "result_cache": store.result_cache.stats(), "generation": store.generation}
+
+def embedding_cache_stats() -> dict:
+    return get_store().embedding_cache.stats()
+
+def search(query: str, k: int = 5, min_similarity_threshold: float = 0.0, **kwargs) -> List[SearchHit]:
+    return get_store().search(query, k, min_similarity_threshold, **kwargs)
+
+def suggest(query: str, k: int = 5) -> List[SearchHit]:
+    return get_store().suggest(query, k)
+
+def build_sparse_index(batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    return get_store().build_sparse_index(batch_size)
+
+def build_ann_index(nlist: Optional[int] = None, nprobe: Optional[int] = None) -> None:
+    get_store().build_ann_index(nlist, nprobe)
+
+def build_quantized_index(kind: str = "int8") -> None:
+    get_store().build_quantized_index(kind)
+
+def find_docs_many(queries: List[str], k: int = 5, min_similarity_threshold: float = 0.0,
+                   **kwargs) -> List[List[SearchHit]]:
+    return get_store().find_docs_many(queries, k, min_similarity_threshold, **kwargs)
+
+def measure_recall(queries: Optional[List[str]] = None, k: int = 10, **kwargs) -> dict:
+    return get_store().measure_recall(queries, k, **kwargs)
+
+def find_docs(query: str, k: int = 5, min_similarity_threshold: float = 0.0,
+              nprobe: Optional[int] = None, exact: bool = False,
+              cancelled: Optional[Callable[[], bool]] = None, filters: Optional[dict] = None) -> List[Document]:
+    return get_store().find_docs(query, k, min_similarity_threshold, nprobe, exact, cancelled, filters)
+
+def recent_docs(n: int = 20, by: str = "updated", filters: Optional[dict] = None) -> List[Document]:
+    return get_store().recent_docs(n, by, filters)
+
+def tag_doc(doc_id: str, tags: List[str]) -> None:
+    get_store().tag_doc(doc_id, tags)